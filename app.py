@@ -1,9 +1,11 @@
 # TESTING
 from blogify import app
 from blogify import db
+from blogify.migrations import upgrade
 
 if __name__ == "__main__":
     app.app_context().push()
     with app.app_context():
         db.create_all()
+        upgrade()
     app.run(debug=True, port=9001)             # can directly run the server with 'python3 main.py'
@@ -0,0 +1,58 @@
+'''
+Password hashing benchmark: bcrypt hashes per second at each work factor, single threaded and
+with several threads in parallel, to pick BCRYPT_LOG_ROUNDS / PASSWORD_HASH_WORKERS for a machine.
+
+    python benchmarks/password_hashing.py --min-cost 10 --max-cost 14 --threads 4
+
+Prints a JSON summary. A login costs one hash, so hashes per second is the login rate the
+password pool can sustain.
+'''
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+
+def hashes_per_second(cost: int, threads: int, duration: float) -> float:
+    salt = bcrypt.gensalt(cost)
+    deadline = time.perf_counter() + duration
+
+    def work():
+        count = 0
+        while count == 0 or time.perf_counter() < deadline:
+            bcrypt.hashpw(b'correct horse battery staple', salt)
+            count += 1
+        return count
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        total = sum(executor.map(lambda _: work(), range(threads)))
+    return total / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--min-cost', type=int, default=10)
+    parser.add_argument('--max-cost', type=int, default=14)
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--duration', type=float, default=2.0, help='seconds to measure each cost for')
+    args = parser.parse_args()
+
+    results = []
+    for cost in range(args.min_cost, args.max_cost + 1):
+        single = hashes_per_second(cost, 1, args.duration)
+        parallel = hashes_per_second(cost, args.threads, args.duration)
+        results.append({
+            "cost": cost,
+            "ms_per_hash": 1000 / single,
+            "hashes_per_second": single,
+            f"hashes_per_second_{args.threads}_threads": parallel,
+        })
+    print(json.dumps({"threads": args.threads, "results": results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+'''
+Query plan check: drives every route over a seeded scratch database (see benchmarks/routes.py),
+runs EXPLAIN QUERY PLAN on each distinct SQL statement they executed and fails when a plan
+scans a whole table or sorts through a temporary B-tree, so a schema or query change can not
+quietly bring back a slow plan.
+
+    python benchmarks/query_plans.py --posts 2000 --verbose
+
+Prints a JSON summary and exits with status 1 on a regression. Plans that are known and accepted
+are listed in ALLOWED with the reason why. The routes run with QUERY_BUDGET_STRICT, so a route
+going over its @query_budget fails the check as well.
+'''
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from routes import ROUTES, scratch_environment, seed_dataset, Driver      # noqa: E402
+
+# (statement fragment, plan fragment, reason) of plan steps that are fine as they are
+ALLOWED = [
+    ('post_fts MATCH', 'SCAN post_fts VIRTUAL TABLE', 'full text search, answered by the FTS5 index itself'),
+    ('post_fts MATCH', 'USE TEMP B-TREE FOR ORDER BY', 'matches are ranked by bm25, which only exists per query'),
+    ('ORDER BY coalesce(post.likes_count', 'USE TEMP B-TREE FOR ORDER BY', "report's most liked post, sorts one author's posts"),
+    ('ORDER BY coalesce(post.dislikes_count', 'USE TEMP B-TREE FOR ORDER BY', "report's most disliked post, sorts one author's posts"),
+    ('FROM report_job', 'USE TEMP B-TREE FOR ORDER BY', 'the few jobs with one data version, found by ix_report_job_data_version'),
+]
+
+EXTRA_ROUTES = ('get_bulk_reactions', 'export_posts')
+
+
+def bad_steps(statement: str, plan) -> list:
+    problems = []
+    for detail in plan:
+        full_scan = detail.startswith('SCAN ') and ' USING ' not in detail and detail != 'SCAN CONSTANT ROW'
+        temp_sort = 'USE TEMP B-TREE' in detail
+        if not (full_scan or temp_sort):
+            continue
+        if any(fragment in statement and step in detail for fragment, step, _ in ALLOWED):
+            continue
+        problems.append(detail)
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--posts', type=int, default=500)
+    parser.add_argument('--reactions', type=int, default=3000)
+    parser.add_argument('--requests', type=int, default=5, help='requests per route')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--verbose', action='store_true', help='include every plan in the output')
+    args = parser.parse_args()
+
+    scratch_environment(os.path.join(tempfile.mkdtemp(prefix='blogify-plans-'), 'plans.db'))
+    rng = random.Random(args.seed)
+    seed_dataset(rng, args.users, args.posts, args.reactions)
+
+    from sqlalchemy import event
+    from blogify import app, db
+    driver = Driver(rng, args.users, args.posts)
+    with app.app_context():
+        engines = list(db.engines.values())
+
+    captured = {}       # statement -> (route, parameters)
+    current = [None]
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().split(None, 1)[0].upper() in ('SELECT', 'UPDATE', 'DELETE', 'WITH'):
+            captured.setdefault(statement, (current[0], parameters))
+
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', capture)
+    for route in ROUTES + EXTRA_ROUTES:
+        current[0] = route
+        for _ in range(args.requests):
+            if route == 'get_bulk_reactions':
+                ids = ','.join(str(rng.randint(1, args.posts)) for _ in range(5))
+                driver.admin.get('/posts/reactions', query_string={'ids': ids})
+            elif route == 'export_posts':
+                driver.admin.get('/export/admin', query_string={'format': rng.choice(('csv', 'jsonl'))}).get_data()
+            else:
+                driver.request(route)
+    for engine in engines:
+        event.remove(engine, 'before_cursor_execute', capture)
+
+    results, failures = [], []
+    with app.app_context(), db.engine.connect() as connection:
+        for statement, (route, parameters) in captured.items():
+            plan = [row[3] for row in connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)]
+            problems = bad_steps(statement, plan)
+            if problems:
+                failures.append({"route": route, "statement": ' '.join(statement.split()), "problems": problems})
+            if args.verbose:
+                results.append({"route": route, "statement": ' '.join(statement.split()), "plan": plan})
+
+    summary = {"statements_checked": len(captured), "failures": failures}
+    if args.verbose:
+        summary["plans"] = results
+    print(json.dumps(summary, indent=2))
+    for failure in failures:
+        print(f"FAIL: {failure['route']}: {'; '.join(failure['problems'])}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+'''
+Route benchmark: seeds a synthetic dataset into a scratch SQLite file and drives the main routes
+through the Flask test client, reporting latency percentiles, requests per second and SQL
+statements per request as JSON.
+
+    python benchmarks/routes.py --users 50 --posts 2000 --reactions 20000 --requests 200 --out baseline.json
+
+The same --seed gives the same dataset and the same request sequence, so two runs (e.g. before
+and after a change) can be compared number by number. All requests are made as the admin user,
+except for `home_anonymous` which shows the page cache for logged out visitors. Routes run with
+QUERY_BUDGET_STRICT, so one going over its @query_budget stops the run.
+'''
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = ('flask python blog post database query cache index latency server request response template '
+         'cursor page report chart user reaction like dislike search engine token session worker thread '
+         'process memory network disk storage schema column table row value feature release deploy').split()
+ROUTES = ('home', 'home_anonymous', 'trending', 'search', 'post', 'react_to_post', 'get_reactions', 'user_posts', 'generate_report')
+PASSWORD = 'benchmark-password'
+
+
+def scratch_environment(db_path: str):
+    ''' Point the app at the scratch database and keep it from touching the real instance folder '''
+    os.environ['DATABASE_URL'] = 'sqlite:///' + db_path
+    os.environ['REPORT_DIR'] = os.path.join(os.path.dirname(db_path), 'reports')
+    os.environ.setdefault('BCRYPT_LOG_ROUNDS', '4')     # seeding and logging in are not what is measured
+    sys.path.insert(0, ROOT)
+
+
+def paragraph(rng: random.Random, words: int) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def seed_dataset(rng: random.Random, users: int, posts: int, reactions: int):
+    from blogify import app, db
+    from blogify.models import User, Post, PostReaction
+    from blogify.passwords import hash_password
+    from blogify.reactions import reconcile_reaction_counts
+    from blogify.rollups import rebuild_rollups
+    from blogify.trending import rebuild_scores
+    from blogify.migrations import upgrade
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        upgrade()
+        pw_hash = hash_password(PASSWORD)
+        db.session.execute(db.insert(User), [
+            {'id': i, 'username': 'admin' if i == 1 else f"user{i}", 'email': f"user{i}@example.com", 'password': pw_hash}
+            for i in range(1, users + 1)
+        ])
+        start = datetime(2024, 1, 1)
+        rows = []
+        for i in range(1, posts + 1):
+            # body lengths roughly like real posts: mostly a few paragraphs, now and then a long read
+            content = '\n\n'.join(paragraph(rng, rng.randint(30, 120)) for _ in range(max(1, int(rng.lognormvariate(1.2, 0.7)))))
+            rows.append({'id': i, 'title': paragraph(rng, rng.randint(3, 9))[:150], 'content': content,
+                         'excerpt': content[:200], 'user_id': rng.randint(1, users),
+                         'date_posted': start + timedelta(minutes=i * 30), 'likes_count': 0, 'dislikes_count': 0})
+        db.session.execute(db.insert(Post), rows)
+        pairs = set()
+        while len(pairs) < min(reactions, users * posts):
+            pairs.add((rng.randint(1, posts), rng.randint(1, users)))
+        db.session.execute(db.insert(PostReaction), [
+            {'post_id': post_id, 'user_id': user_id, 'reaction_type': 'like' if rng.random() < 0.8 else 'dislike',
+             'date_reacted': start + timedelta(minutes=post_id * 30 + rng.randint(0, 60 * 24 * 30))}
+            for post_id, user_id in sorted(pairs)
+        ])
+        db.session.commit()
+        reconcile_reaction_counts()
+        rebuild_rollups()
+        with db.engine.begin() as connection:
+            rebuild_scores(connection)
+
+
+class Driver:
+    ''' Makes the requests for one route, counting the SQL statements each one runs '''
+
+    def __init__(self, rng: random.Random, users: int, posts: int):
+        from blogify import app
+        self.app = app
+        app.config['WTF_CSRF_ENABLED'] = False      # the login form is posted without fetching it first
+        # a route over its @query_budget raises, and the test client passes that on instead of a 500
+        app.config['QUERY_BUDGET_STRICT'] = True
+        app.config['PROPAGATE_EXCEPTIONS'] = True
+        self.rng = rng
+        self.users = users
+        self.posts = posts
+        self.admin = self._client(logged_in=True)
+        self.anonymous = self._client(logged_in=False)
+        self.home_cursors = [None]
+
+    def _client(self, logged_in: bool):
+        client = self.app.test_client()
+        if logged_in:
+            response = client.post('/login', data={'email': 'user1@example.com', 'password': PASSWORD})
+            assert response.status_code == 302 and response.location.endswith('/home'), "logging in failed"
+        return client
+
+    def request(self, route: str):
+        rng = self.rng
+        if route == 'home':
+            # page through the feed, starting over now and then
+            cursor = rng.choice(self.home_cursors)
+            response = self.admin.get('/home', query_string={'cursor': cursor} if cursor else None)
+            next_cursor = _next_cursor(response)
+            if next_cursor and len(self.home_cursors) < 50:
+                self.home_cursors.append(next_cursor)
+            return response
+        if route == 'home_anonymous':
+            return self.anonymous.get('/home')
+        if route == 'trending':
+            return self.admin.get('/trending')
+        if route == 'search':
+            return self.admin.get('/search', query_string={'query': ' '.join(rng.sample(WORDS, rng.randint(1, 2)))})
+        if route == 'post':
+            return self.admin.get(f"/post/{rng.randint(1, self.posts)}")
+        if route == 'react_to_post':
+            return self.admin.post(f"/post/{rng.randint(1, self.posts)}/react",
+                                   json={'reaction_type': rng.choice(('like', 'dislike'))})
+        if route == 'get_reactions':
+            return self.admin.get(f"/post/{rng.randint(1, self.posts)}/reactions")
+        if route == 'user_posts':
+            user = rng.randint(1, self.users)
+            return self.admin.get(f"/user/{'admin' if user == 1 else f'user{user}'}")
+        if route == 'generate_report':
+            user = rng.randint(1, self.users)
+            return self.admin.post(f"/generate_report/{'admin' if user == 1 else f'user{user}'}",
+                                   query_string={'type': rng.choice(('pdf', 'csv', 'excel'))})
+        raise ValueError(route)
+
+
+def _next_cursor(response):
+    import re
+    match = re.search(r'href="[^"]*cursor=([^"&]+)[^"]*">Older', response.get_data(as_text=True))
+    return match.group(1) if match else None
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    index = (len(ordered) - 1) * pct / 100
+    low = int(index)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (index - low)
+
+
+def run_route(driver: Driver, route: str, requests: int, warmup: int) -> dict:
+    from blogify import db
+    from sqlalchemy import event
+
+    statements = [0]
+    counter = lambda *args: statements.__setitem__(0, statements[0] + 1)
+    with driver.app.app_context():
+        # with DB_READ_ROUTING the read only routes run on the read engine
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', counter)
+    try:
+        for _ in range(warmup):
+            driver.request(route)
+        latencies, queries, errors = [], [], 0
+        started = time.perf_counter()
+        for _ in range(requests):
+            statements[0] = 0
+            t0 = time.perf_counter()
+            response = driver.request(route)
+            latencies.append(time.perf_counter() - t0)
+            queries.append(statements[0])
+            errors += response.status_code >= 400
+        elapsed = time.perf_counter() - started
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', counter)
+
+    ms = [latency * 1000 for latency in latencies]
+    return {
+        "requests": requests,
+        "errors": errors,
+        "requests_per_second": requests / elapsed,
+        "latency_ms": {"p50": percentile(ms, 50), "p95": percentile(ms, 95), "p99": percentile(ms, 99),
+                       "mean": statistics.fmean(ms), "max": max(ms)},
+        "queries_per_request": {"mean": statistics.fmean(queries), "max": max(queries)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--posts', type=int, default=2000)
+    parser.add_argument('--reactions', type=int, default=20000)
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per route')
+    parser.add_argument('--warmup', type=int, default=20, help='unmeasured requests per route before measuring')
+    parser.add_argument('--routes', default=','.join(ROUTES), help='comma separated subset of: ' + ', '.join(ROUTES))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db', help='scratch database file (default: a new temporary directory)')
+    parser.add_argument('--out', help='also write the JSON summary to this file')
+    args = parser.parse_args()
+
+    routes = [route for route in args.routes.split(',') if route]
+    unknown = set(routes) - set(ROUTES)
+    if unknown:
+        parser.error(f"unknown route(s): {', '.join(sorted(unknown))}")
+
+    db_path = os.path.abspath(args.db) if args.db else os.path.join(tempfile.mkdtemp(prefix='blogify-bench-'), 'bench.db')
+    scratch_environment(db_path)
+    rng = random.Random(args.seed)
+
+    started = time.perf_counter()
+    seed_dataset(rng, args.users, args.posts, args.reactions)
+    seed_seconds = time.perf_counter() - started
+
+    driver = Driver(rng, args.users, args.posts)
+    results = {route: run_route(driver, route, args.requests, args.warmup) for route in routes}
+
+    summary = {
+        "dataset": {"users": args.users, "posts": args.posts, "reactions": args.reactions, "seed": args.seed,
+                    "database": db_path, "seed_seconds": seed_seconds},
+        "python": platform.python_version(),
+        "routes": results,
+    }
+    output = json.dumps(summary, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
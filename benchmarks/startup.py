@@ -0,0 +1,76 @@
+'''
+Startup benchmark: how long `import blogify` takes and how much memory a fresh worker holds after it.
+
+    python benchmarks/startup.py --runs 5 --max-import-ms 1500 --max-rss-mb 120
+
+Every run happens in a fresh interpreter. Prints a JSON summary and exits with status 1 when a
+threshold is exceeded or when one of the reporting libraries (only needed by the report worker
+processes) got imported, so it can guard against startup regressions in CI.
+'''
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# only the report worker processes need these, a web worker must not pay for them
+LAZY_MODULES = ['pandas', 'matplotlib', 'seaborn', 'reportlab', 'openpyxl']
+
+PROBE = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import blogify
+elapsed = time.perf_counter() - start
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform == "darwin":
+    rss_kb //= 1024
+print(json.dumps({
+    "import_ms": elapsed * 1000,
+    "rss_mb": rss_kb / 1024,
+    "loaded": [m for m in %r if m in sys.modules],
+}))
+''' % (LAZY_MODULES,)
+
+
+def probe() -> dict:
+    output = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-import-ms', type=float, default=None)
+    parser.add_argument('--max-rss-mb', type=float, default=None)
+    args = parser.parse_args()
+
+    results = [probe() for _ in range(args.runs)]
+    import_ms = [r['import_ms'] for r in results]
+    rss_mb = [r['rss_mb'] for r in results]
+    loaded = sorted({m for r in results for m in r['loaded']})
+
+    summary = {
+        "runs": args.runs,
+        "import_ms": {"median": statistics.median(import_ms), "min": min(import_ms), "max": max(import_ms)},
+        "rss_mb": {"median": statistics.median(rss_mb), "max": max(rss_mb)},
+        "eagerly_loaded_report_modules": loaded,
+    }
+    print(json.dumps(summary, indent=2))
+
+    failures = []
+    if loaded:
+        failures.append(f"reporting modules imported at startup: {', '.join(loaded)}")
+    if args.max_import_ms is not None and summary["import_ms"]["median"] > args.max_import_ms:
+        failures.append(f"median import time {summary['import_ms']['median']:.0f} ms > {args.max_import_ms:.0f} ms")
+    if args.max_rss_mb is not None and summary["rss_mb"]["median"] > args.max_rss_mb:
+        failures.append(f"median RSS {summary['rss_mb']['median']:.1f} MB > {args.max_rss_mb:.1f} MB")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
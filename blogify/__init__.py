@@ -10,19 +10,113 @@ app = Flask(__name__)
 # crsf key for protection against online attacks
 app.config['SECRET_KEY'] = '7c4fb322e610bcbe62d664c0cc1fb7f0'
 # set path for database, NOTE: /// -> indicates start point i.e, relative path
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///database.db')
 
-# set up SMTP server 
-app.config['MAIL_SERVER'] = "smtp.googlemail.com"
-app.config['MAIL_PORT'] = 587
-app.config['MAIL_USE_TLS'] = True
+# connection pool and SQLite pragmas applied to every connection, see blogify/database.py
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 3600))
+app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+# the page cache is per connection: up to (DB_POOL_SIZE + DB_MAX_OVERFLOW) of them, plus as many read
+# connections with DB_READ_ROUTING, in every worker process. The memory mapped file is shared instead
+app.config['SQLITE_CACHE_SIZE_KB'] = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 4 * 1024))
+app.config['SQLITE_MMAP_SIZE'] = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+# route the SELECTs of read only pages to their own pool (DATABASE_READ_URL, defaults to the same database)
+app.config['DB_READ_ROUTING'] = os.environ.get('DB_READ_ROUTING', '0') == '1'
+app.config['DATABASE_READ_URL'] = os.environ.get('DATABASE_READ_URL')
+app.config['DB_READ_POOL_SIZE'] = int(os.environ.get('DB_READ_POOL_SIZE', 10))
+
+# reaction counters: write-behind batches the like/dislike counter updates in memory and
+# flushes them every REACTION_FLUSH_INTERVAL seconds, run `flask reconcile-reactions` to fix drift
+app.config['REACTION_COUNTER_WRITE_BEHIND'] = os.environ.get('REACTION_COUNTER_WRITE_BEHIND', '0') == '1'
+app.config['REACTION_FLUSH_INTERVAL'] = float(os.environ.get('REACTION_FLUSH_INTERVAL', 2.0))
+
+# reports are rendered by a pool of worker processes, finished files are kept in REPORT_DIR and
+# dropped once they were not asked for in REPORT_JOB_TTL seconds
+app.config['REPORT_WORKERS'] = int(os.environ.get('REPORT_WORKERS', 2))
+app.config['REPORT_DIR'] = os.environ.get('REPORT_DIR')     # defaults to <instance folder>/reports
+app.config['REPORT_JOB_TTL'] = float(os.environ.get('REPORT_JOB_TTL', 24 * 3600))
+app.config['REPORT_CACHE_MAX_BYTES'] = int(os.environ.get('REPORT_CACHE_MAX_BYTES', 200 * 1024 * 1024))
+# a job still queued after REPORT_JOB_TIMEOUT seconds is assumed lost and rendered again
+app.config['REPORT_JOB_TIMEOUT'] = float(os.environ.get('REPORT_JOB_TIMEOUT', 600))
+
+# threads rendering the size/format variants of uploaded profile pictures
+app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', 2))
+
+# static files are served under content hashed urls with far future cache headers, see blogify/assets.py
+app.config['STATIC_FINGERPRINT'] = os.environ.get('STATIC_FINGERPRINT', '1') == '1'
+app.config['STATIC_GZIP_DIR'] = os.environ.get('STATIC_GZIP_DIR')     # defaults to <instance folder>/static_gz
+
+# full page cache for logged out visitors, RESPONSE_CACHE_BACKEND names the CacheBackend class to use
+app.config['RESPONSE_CACHE_ENABLED'] = os.environ.get('RESPONSE_CACHE_ENABLED', '1') == '1'
+app.config['RESPONSE_CACHE_BACKEND'] = os.environ.get('RESPONSE_CACHE_BACKEND', 'blogify.cache.LocalCache')
+app.config['RESPONSE_CACHE_TTL'] = float(os.environ.get('RESPONSE_CACHE_TTL', 60))
+app.config['RESPONSE_CACHE_MAX_ENTRIES'] = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 1000))
+app.config['RESPONSE_CACHE_MAX_BYTES'] = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+# rendered post cards, keyed by their content so they never need explicit invalidation
+app.config['FRAGMENT_CACHE_TTL'] = float(os.environ.get('FRAGMENT_CACHE_TTL', 3600))
+app.config['FRAGMENT_CACHE_MAX_ENTRIES'] = int(os.environ.get('FRAGMENT_CACHE_MAX_ENTRIES', 5000))
+app.config['FRAGMENT_CACHE_MAX_BYTES'] = int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+
+# logged in users, so identifying one is not a SELECT on every request. The cache is per process: a
+# change shows up at once for the session that made it, other sessions of that user can see the old
+# name, email and picture on other workers for up to USER_CACHE_TTL seconds
+app.config['USER_CACHE_TTL'] = float(os.environ.get('USER_CACHE_TTL', 30))
+app.config['USER_CACHE_MAX_ENTRIES'] = int(os.environ.get('USER_CACHE_MAX_ENTRIES', 10000))
+
+# bcrypt work factor (each +1 doubles the cost) and the threads allowed to hash at the same time,
+# a request waits at most PASSWORD_HASH_TIMEOUT seconds for one before it gets a 503
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))
+app.config['PASSWORD_HASH_TIMEOUT'] = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10.0))
+
+# per endpoint request metrics on /metrics (admin or "Authorization: Bearer <METRICS_TOKEN>"), requests
+# slower than SLOW_REQUEST_SECONDS are logged with their SQL statements (0 turns the log off)
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+app.config['SLOW_REQUEST_SECONDS'] = float(os.environ.get('SLOW_REQUEST_SECONDS', 0))
+
+# trending feed: reactions lose half their weight every TRENDING_HALF_LIFE_HOURS, scores are rebased
+# every TRENDING_TICK_INTERVAL seconds and those below TRENDING_MIN_SCORE leave the feed
+app.config['TRENDING_HALF_LIFE_HOURS'] = float(os.environ.get('TRENDING_HALF_LIFE_HOURS', 24))
+app.config['TRENDING_LIKE_WEIGHT'] = float(os.environ.get('TRENDING_LIKE_WEIGHT', 1.0))
+app.config['TRENDING_DISLIKE_WEIGHT'] = float(os.environ.get('TRENDING_DISLIKE_WEIGHT', 0.5))
+app.config['TRENDING_TICK_INTERVAL'] = float(os.environ.get('TRENDING_TICK_INTERVAL', 3600))
+app.config['TRENDING_MIN_SCORE'] = float(os.environ.get('TRENDING_MIN_SCORE', 0.01))
+
+# production server (serve.py): worker processes forked from a preloaded master, threads per worker
+app.config['WEB_BIND'] = os.environ.get('WEB_BIND', '0.0.0.0:8000')
+app.config['WEB_WORKERS'] = int(os.environ.get('WEB_WORKERS', os.cpu_count() or 1))
+app.config['WEB_THREADS'] = int(os.environ.get('WEB_THREADS', 4))
+app.config['WEB_TIMEOUT'] = int(os.environ.get('WEB_TIMEOUT', 60))
+app.config['WEB_GRACEFUL_TIMEOUT'] = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+app.config['WEB_MAX_REQUESTS'] = int(os.environ.get('WEB_MAX_REQUESTS', 0))     # recycle workers after this many, 0 never
+
+# set up SMTP server (point it at a local stand-in with MAIL_SERVER=localhost MAIL_PORT=1025 MAIL_USE_TLS=0)
+app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', "smtp.googlemail.com")
+app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
+app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', '1') == '1'
 # set user and pass
 app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
 app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
 
+# mails are queued in the mail_outbox table and sent by a background thread in batches over one
+# connection, failed ones are retried MAIL_MAX_ATTEMPTS times with exponential backoff
+app.config['MAIL_OUTBOX_BATCH'] = int(os.environ.get('MAIL_OUTBOX_BATCH', 20))
+app.config['MAIL_OUTBOX_INTERVAL'] = float(os.environ.get('MAIL_OUTBOX_INTERVAL', 5.0))
+app.config['MAIL_MAX_ATTEMPTS'] = int(os.environ.get('MAIL_MAX_ATTEMPTS', 6))
+app.config['MAIL_RETRY_BACKOFF'] = float(os.environ.get('MAIL_RETRY_BACKOFF', 30.0))
+
 mail = Mail(app)
 
-db = SQLAlchemy(app)
+from blogify.database import configure_database, install_connection_hooks, RoutingSession
+configure_database()
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+install_connection_hooks(db)
 
 # for encrypting passwords
 bcrypt = Bcrypt(app)    
@@ -34,3 +128,20 @@ login_manager.login_message_category = "danger"      # set the flash message the
 
 # importing here to avoid circular importing issues
 from blogify import routes
+from blogify import assets
+from blogify import migrations
+from blogify import metrics
+
+
+def create_app():
+    '''
+    The WSGI application, prepared for being forked into worker processes: the schema is brought up
+    to date once, here, and the connections that used are closed so no worker inherits them.
+    Everything that holds threads or connections also resets itself in a forked child (blogify/forksafe.py).
+    '''
+    with app.app_context():
+        db.create_all()
+        migrations.upgrade()
+        for engine in db.engines.values():
+            engine.dispose()
+    return app
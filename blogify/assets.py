@@ -0,0 +1,139 @@
+import os
+import re
+import gzip
+import shutil
+import hashlib
+import mimetypes
+import threading
+import click
+from flask import request, send_file, abort
+from werkzeug.security import safe_join
+from blogify import app
+
+
+# -- Fingerprinted static files --
+# url_for('static', filename='main.css') becomes /static/main.<content hash>.css. Such a URL can
+# never point at different content, so it is served with a one year "immutable" cache lifetime and
+# browsers do not even revalidate it. Text assets also get a gzip copy (built by `flask build-static`
+# or on first use) that is served to clients which accept it.
+
+FINGERPRINT_LENGTH = 10
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+_FINGERPRINTED = re.compile(r'^(?P<stem>.+)\.(?P<hash>[0-9a-f]{%d})(?P<ext>\.[^./]+)$' % FINGERPRINT_LENGTH)
+
+_hashes = {}        # filename -> (mtime, size, content hash)
+_lock = threading.Lock()
+
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()[:FINGERPRINT_LENGTH]
+
+
+def fingerprint(filename: str):
+    ''' Content hash of a static file, cached until the file changes, None if it does not exist '''
+    path = safe_join(app.static_folder, filename)
+    try:
+        stat = os.stat(path) if path else None
+    except OSError:
+        stat = None
+    if stat is None:
+        return None
+    with _lock:
+        cached = _hashes.get(filename)
+    if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+        return cached[2]
+    content_hash = _file_hash(path)
+    with _lock:
+        _hashes[filename] = (stat.st_mtime, stat.st_size, content_hash)
+    return content_hash
+
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    if endpoint != 'static' or not app.config.get('STATIC_FINGERPRINT', True):
+        return
+    filename = values.get('filename')
+    content_hash = fingerprint(filename) if filename else None
+    if content_hash:
+        stem, ext = os.path.splitext(filename)
+        values['filename'] = f"{stem}.{content_hash}{ext}"
+
+
+def _is_compressible(filename: str) -> bool:
+    mimetype, _ = mimetypes.guess_type(filename)
+    return bool(mimetype) and mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+def _gzip_path(filename: str) -> str:
+    return os.path.join(app.config.get('STATIC_GZIP_DIR') or os.path.join(app.instance_path, 'static_gz'), filename + '.gz')
+
+
+def precompress(filename: str):
+    ''' Path of an up to date gzip copy of a static file (written if missing or stale) '''
+    source = safe_join(app.static_folder, filename)
+    target = _gzip_path(filename)
+    if not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(source):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # several threads/workers may race on the first request, each writes its own temporary file
+        part = f"{target}.{os.getpid()}.{threading.get_ident()}.part"
+        with open(source, 'rb') as src, gzip.open(part, 'wb', compresslevel=9) as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(part, target)
+    return target
+
+
+def send_static(filename: str):
+    ''' Replaces Flask's static view: strips the fingerprint and picks the gzip copy when possible '''
+    immutable = False
+    match = _FINGERPRINTED.match(filename)
+    if match:
+        original = match.group('stem') + match.group('ext')
+        current = fingerprint(original)
+        if current is not None:
+            # an outdated hash still gets the current file, just without the long cache lifetime
+            immutable = current == match.group('hash')
+            filename = original
+
+    path = safe_join(app.static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    max_age = IMMUTABLE_MAX_AGE if immutable else app.get_send_file_max_age(filename)
+    gzip_ok = 'gzip' in request.accept_encodings and _is_compressible(filename)
+    if gzip_ok:
+        response = send_file(precompress(filename), mimetype=mimetypes.guess_type(filename)[0], max_age=max_age)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = send_file(path, max_age=max_age)
+    if _is_compressible(filename):
+        response.vary.add('Accept-Encoding')
+    if immutable:
+        response.cache_control.immutable = True
+        response.cache_control.public = True
+    return response
+
+
+app.view_functions['static'] = send_static
+
+
+@app.cli.command('build-static')
+def build_static():
+    ''' Fingerprint every static file and write gzip copies of the compressible ones '''
+    fingerprinted = compressed = 0
+    for root, _, files in os.walk(app.static_folder):
+        for name in files:
+            if name.endswith('.part'):
+                continue
+            filename = os.path.relpath(os.path.join(root, name), app.static_folder).replace(os.sep, '/')
+            fingerprint(filename)
+            fingerprinted += 1
+            if _is_compressible(filename):
+                precompress(filename)
+                compressed += 1
+    click.echo(f"Fingerprinted {fingerprinted} file(s), precompressed {compressed}.")
@@ -0,0 +1,163 @@
+import sys
+import time
+import threading
+from collections import OrderedDict
+from functools import wraps
+from importlib import import_module
+from urllib.parse import urlencode
+from flask import g, request, session, make_response
+from flask_login import current_user
+from blogify import app
+
+
+# -- Caching --
+# A cache backend stores values under a key together with a set of tags, `invalidate(*tags)` drops
+# every entry carrying one of them. LocalCache keeps everything in this process; a shared store
+# (redis, memcached, ...) only needs to implement the same four methods and be named in
+# RESPONSE_CACHE_BACKEND. Note that with LocalCache every worker process has its own copy, an
+# invalidation only reaches the worker handling the write and the TTL bounds staleness elsewhere.
+
+class CacheBackend:
+    def get(self, key: str):
+        raise NotImplementedError
+
+    def set(self, key: str, value, ttl: float, tags=(), size: int = 0):
+        raise NotImplementedError
+
+    def invalidate(self, *tags):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LocalCache(CacheBackend):
+    ''' In-process LRU cache bounded by entry count and (approximate) total size, with per entry TTL '''
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()      # key -> (expires, value, tags, size)
+        self._tags = {}                    # tag -> set of keys
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value, ttl: float, tags=(), size: int = 0):
+        size = size or sys.getsizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, value, tuple(tags), size)
+            self._bytes += size
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, *tags):
+        with self._lock:
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {'entries': len(self._entries), 'bytes': self._bytes, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry[3]
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+def _load_backend(config_key: str) -> CacheBackend:
+    module_name, _, class_name = app.config[config_key].rpartition('.')
+    backend = getattr(import_module(module_name), class_name)
+    return backend(max_entries=app.config['RESPONSE_CACHE_MAX_ENTRIES'], max_bytes=app.config['RESPONSE_CACHE_MAX_BYTES'])
+
+
+response_cache = _load_backend('RESPONSE_CACHE_BACKEND')
+
+
+# -- Full page cache for anonymous visitors --
+
+def cache_tags(*tags):
+    ''' Tag the page being rendered, writes that touch any of these tags drop it from the cache '''
+    g.setdefault('cache_tags', set()).update(tags)
+
+
+def invalidate(*tags):
+    response_cache.invalidate(*tags)
+
+
+def _cacheable() -> bool:
+    # logged in users see their own reactions and links, pending flash messages are one-off
+    return app.config['RESPONSE_CACHE_ENABLED'] and request.method == 'GET' \
+        and not current_user.is_authenticated and '_flashes' not in session
+
+
+def _page_key(args) -> str:
+    # only the arguments the view reads are part of the key, in a fixed order
+    values = [(name, request.args[name]) for name in args if name in request.args]
+    return 'page:' + request.path + ('?' + urlencode(values) if values else '')
+
+
+def cached_page(*args: str):
+    '''
+    Serve logged out visitors from response_cache, `args` are the query string arguments the view reads.
+    Requests carrying any other argument are rendered uncached, so made up query strings can not push
+    the real pages out of the cache.
+    '''
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*view_args, **kwargs):
+            if not _cacheable() or any(name not in args for name in request.args):
+                return view(*view_args, **kwargs)
+
+            key = _page_key(args)
+            hit = response_cache.get(key)
+            if hit is not None:
+                body, status, headers = hit
+                response = make_response(body, status, headers)
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            response = make_response(view(*view_args, **kwargs))
+            if response.status_code == 200 and not response.direct_passthrough and not session.modified:
+                body = response.get_data()
+                headers = [(name, value) for name, value in response.headers if name.lower() != 'set-cookie']
+                response_cache.set(key, (body, response.status_code, headers), ttl=app.config['RESPONSE_CACHE_TTL'],
+                                   tags=g.get('cache_tags', ()), size=len(body))
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
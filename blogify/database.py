@@ -0,0 +1,96 @@
+import sqlite3
+from functools import wraps
+from flask import g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from blogify import app
+from blogify.forksafe import reset_after_fork
+
+
+# -- Database connections --
+# Every SQLite connection gets the pragmas from DB_* / SQLITE_* config: WAL lets readers carry on
+# while a write commits, synchronous=NORMAL is durable in WAL mode except for a power loss right
+# at commit, busy_timeout makes writers queue up instead of failing with "database is locked".
+# Pool settings are applied to database files (in-memory SQLite keeps its single connection).
+# Only SQLite is supported: search uses FTS5 and the counters and rollups use its upsert syntax. With DB_READ_ROUTING, SELECTs of routes marked @read_only go to a separate pool
+# (DATABASE_READ_URL, by default the same database) whose connections are query_only.
+
+READ_BIND = 'read'
+
+
+def _pool_options(url: str, prefix: str) -> dict:
+    parsed = make_url(url)
+    if parsed.get_backend_name() == 'sqlite' and parsed.database in (None, '', ':memory:'):
+        return {}
+    return {
+        'pool_size': app.config[f'{prefix}_POOL_SIZE'],
+        'max_overflow': app.config['DB_MAX_OVERFLOW'],
+        'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+        'pool_recycle': app.config['DB_POOL_RECYCLE'],
+    }
+
+
+def _require_sqlite(url: str, setting: str):
+    backend = make_url(url).get_backend_name()
+    if backend != 'sqlite':
+        raise RuntimeError(f"{setting} must be a sqlite:/// url, Blogify does not support {backend} databases")
+
+
+def configure_database():
+    ''' Fill in engine options and the read bind from config, before SQLAlchemy(app) creates the engines '''
+    url = app.config['SQLALCHEMY_DATABASE_URI']
+    _require_sqlite(url, 'DATABASE_URL')
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {**_pool_options(url, 'DB'), **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})}
+    if app.config['DB_READ_ROUTING']:
+        read_url = app.config['DATABASE_READ_URL'] or url
+        _require_sqlite(read_url, 'DATABASE_READ_URL')
+        app.config.setdefault('SQLALCHEMY_BINDS', {})[READ_BIND] = {'url': read_url, **_pool_options(read_url, 'DB_READ')}
+
+
+def _apply_pragmas(dbapi_connection, read_only: bool):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    if not read_only:
+        # persistent, stored in the database file; read connections just use it
+        cursor.execute(f"PRAGMA journal_mode={app.config['SQLITE_JOURNAL_MODE']}")
+    cursor.execute(f"PRAGMA synchronous={app.config['SQLITE_SYNCHRONOUS']}")
+    cursor.execute(f"PRAGMA busy_timeout={int(app.config['SQLITE_BUSY_TIMEOUT_MS'])}")
+    cursor.execute(f"PRAGMA cache_size={-int(app.config['SQLITE_CACHE_SIZE_KB'])}")
+    cursor.execute(f"PRAGMA mmap_size={int(app.config['SQLITE_MMAP_SIZE'])}")
+    if read_only:
+        cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+def install_connection_hooks(db):
+    with app.app_context():
+        engines = dict(db.engines)
+    for bind_key, engine in engines.items():
+        read_only = bind_key == READ_BIND
+        event.listen(engine, 'connect', lambda dbapi_connection, record, read_only=read_only:
+                     _apply_pragmas(dbapi_connection, read_only))
+    # a forked worker must not use the pooled connections of its parent, close=False leaves them to the parent
+    reset_after_fork(lambda: [engine.dispose(close=False) for engine in engines.values()])
+
+
+class RoutingSession(Session):
+    ''' Sends the SELECTs of @read_only routes to the read pool, everything else to the primary '''
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and getattr(clause, 'is_select', False) \
+                and has_request_context() and g.get('db_read_only'):
+            engine = self._db.engines.get(READ_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_only(view):
+    ''' Mark a route that only reads, its queries may be served by the read pool '''
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_read_only = True
+        return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,52 @@
+import io
+import csv
+import json
+from sqlalchemy import select
+from blogify import db
+from blogify.models import Post
+
+
+# -- Streaming post export --
+# Rows are pulled from the database in chunks of EXPORT_CHUNK_SIZE and written out as they arrive,
+# so memory stays flat no matter how many posts an author has and the first bytes go out at once.
+
+EXPORT_CHUNK_SIZE = 500
+
+EXPORT_FORMATS = {
+    'csv': ('csv', 'text/csv'),
+    'jsonl': ('jsonl', 'application/x-ndjson'),
+}
+
+EXPORT_COLUMNS = ['title', 'date_posted', 'content', 'likes', 'dislikes']
+
+
+def _post_rows(user_id: int):
+    statement = select(
+        Post.title, Post.date_posted, Post.content,
+        Post.likes_count.label('likes'), Post.dislikes_count.label('dislikes'),
+    ).where(Post.user_id == user_id)\
+        .order_by(Post.date_posted.desc())\
+        .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+    # partitions() hands out one fetched chunk at a time, the cursor is never read in full
+    for chunk in db.session.execute(statement).partitions():
+        yield chunk
+
+
+def stream_csv(user_id: int):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+    for chunk in _post_rows(user_id):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+
+
+def stream_jsonl(user_id: int):
+    for chunk in _post_rows(user_id):
+        yield ''.join(
+            json.dumps({**row._asdict(), 'date_posted': row.date_posted.isoformat()}) + '\n'
+            for row in chunk
+        )
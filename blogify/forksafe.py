@@ -0,0 +1,47 @@
+import os
+import threading
+
+
+# -- Per process state --
+# A forked worker (see serve.py) inherits every Python object of the master but none of its threads:
+# an inherited pool has no workers behind it, an inherited daemon thread is not running and an
+# inherited lock may be stuck in the state some other thread left it in. Everything of that kind is
+# either built lazily through ForkSafeLazy, which forgets its value in a forked child so the child
+# builds its own on first use, or reset with a reset_after_fork() callback.
+
+def reset_after_fork(fn):
+    ''' Run fn() in every forked child process, usable as a decorator '''
+    os.register_at_fork(after_in_child=fn)
+    return fn
+
+
+def start_daemon(target, name: str) -> threading.Thread:
+    thread = threading.Thread(target=target, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+class ForkSafeLazy:
+    ''' factory() called on first get() in each process, the result is shared by that process' threads '''
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._reset()
+        reset_after_fork(self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._value = None
+
+    def get(self):
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    self._value = self._factory()
+        return self._value
+
+    def discard(self, value):
+        ''' Forget value, unless another thread already replaced it, so the next get() builds a new one '''
+        with self._lock:
+            if self._value is value:
+                self._value = None
@@ -0,0 +1,33 @@
+import hashlib
+from markupsafe import Markup
+from blogify import app
+from blogify.cache import LocalCache
+from blogify.images import variants_ready
+
+
+# -- Post card fragment cache --
+# The user independent part of a feed card (author, date, title, excerpt, links) is rendered once
+# and reused. The key is derived from everything the card shows, so an edited post or a renamed
+# author / new avatar simply maps to a new key and the old entry ages out of the LRU. Reaction
+# buttons depend on the viewer and stay in the page templates.
+
+fragment_cache = LocalCache(max_entries=app.config['FRAGMENT_CACHE_MAX_ENTRIES'],
+                            max_bytes=app.config['FRAGMENT_CACHE_MAX_BYTES'])
+
+
+def _card_version(post) -> str:
+    author = post.author
+    parts = [post.title, post.date_posted.isoformat(), post.excerpt, author.username, author.profile_pic,
+             # avatar urls point at the original file until the resized variants exist
+             str(variants_ready(author.profile_pic))]
+    return hashlib.blake2b('\x1f'.join(parts).encode('utf-8'), digest_size=12).hexdigest()
+
+
+@app.template_global()
+def post_card(post) -> Markup:
+    key = f"card:{post.id}:{_card_version(post)}"
+    html = fragment_cache.get(key)
+    if html is None:
+        html = app.jinja_env.get_template('post_card.html').render(post=post)
+        fragment_cache.set(key, html, ttl=app.config['FRAGMENT_CACHE_TTL'], size=len(html))
+    return Markup(html)
@@ -0,0 +1,144 @@
+import io
+import os
+import hashlib
+import click
+from concurrent.futures import ThreadPoolExecutor
+from flask import url_for
+from blogify import app
+from blogify.forksafe import ForkSafeLazy
+
+
+# -- Profile picture pipeline --
+# Uploads are stored as-is under a name derived from their content (so the same picture is only
+# ever stored once) and the request returns right away. A small thread pool then renders square
+# variants in every size the templates use, as JPEG and as the much smaller WebP.
+
+PICTURE_DIR = 'profile_pics'
+VARIANT_DIR = 'profile_pics/variants'
+
+# 'sm' fits the 65px feed avatars, 'md' the 125px account picture, every size also serves as 2x of the one before
+VARIANT_SIZES = {'sm': 65, 'md': 125, 'lg': 250}
+VARIANT_FORMATS = {'jpg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+                   'webp': ('WEBP', {'quality': 80, 'method': 4})}
+RETINA_SIZES = {'sm': 'md', 'md': 'lg'}
+
+_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'GIF': '.gif', 'WEBP': '.webp'}
+
+_executor = ForkSafeLazy(lambda: ThreadPoolExecutor(max_workers=app.config.get('IMAGE_WORKERS', 2),
+                                                     thread_name_prefix='image-variants'))
+_ready = set()      # variants known to exist on disk, they are never modified once written
+
+
+def _static_path(*parts) -> str:
+    return os.path.join(app.static_folder, *parts)
+
+
+def _variant_name(picture: str, size: str, fmt: str) -> str:
+    stem, _ = os.path.splitext(picture)
+    return f"{stem}_{size}.{fmt}"
+
+
+def _has_all_variants(picture: str) -> bool:
+    return all(os.path.exists(_static_path(VARIANT_DIR, _variant_name(picture, size, fmt)))
+               for size in VARIANT_SIZES for fmt in VARIANT_FORMATS)
+
+
+def save_picture(form_picture) -> str:
+    ''' Store an uploaded picture under its content hash and queue its variants, returns the file name '''
+    if form_picture is None:
+        raise ValueError("form_picture cannot be None")
+    # Pillow is only needed when someone uploads a picture, keep it out of worker startup
+    from PIL import Image
+
+    data = form_picture.read()
+    try:
+        # verify() only parses the headers, the actual decoding happens in the background
+        with Image.open(io.BytesIO(data)) as image:
+            image_format = image.format
+            image.verify()
+    except Exception as e:
+        raise Exception("Error occurred while saving image: {}".format(str(e)))
+    if image_format not in _EXTENSIONS:
+        raise Exception("Error occurred while saving image: unsupported format {}".format(image_format))
+
+    # 15 hex digits + '.webp' still fits the 20 characters of user.profile_pic
+    pic_name = hashlib.sha256(data).hexdigest()[:15] + _EXTENSIONS[image_format]
+    pic_path = _static_path(PICTURE_DIR, pic_name)
+    if not os.path.exists(pic_path):
+        with open(pic_path + '.part', 'wb') as f:
+            f.write(data)
+        os.replace(pic_path + '.part', pic_path)
+
+    if not _has_all_variants(pic_name):
+        future = _executor.get().submit(generate_variants, pic_path)
+        future.add_done_callback(_log_failure)
+    return pic_name
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        app.logger.error("Generating picture variants failed: %s", future.exception())
+
+
+def generate_variants(pic_path: str):
+    ''' Render every size/format variant of one picture, each file appears atomically '''
+    from PIL import Image, ImageOps
+
+    os.makedirs(_static_path(VARIANT_DIR), exist_ok=True)
+    picture = os.path.basename(pic_path)
+    with Image.open(pic_path) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        for size, pixels in VARIANT_SIZES.items():
+            square = ImageOps.fit(image, (pixels, pixels), method=Image.Resampling.LANCZOS)
+            for fmt, (pil_format, options) in VARIANT_FORMATS.items():
+                variant_path = _static_path(VARIANT_DIR, _variant_name(picture, size, fmt))
+                square.save(variant_path + '.part', pil_format, **options)
+                os.replace(variant_path + '.part', variant_path)
+
+
+def _variant_exists(name: str) -> bool:
+    if name in _ready:
+        return True
+    if os.path.exists(_static_path(VARIANT_DIR, name)):
+        _ready.add(name)
+        return True
+    return False
+
+
+def variants_ready(picture: str, sizes=('sm', 'md')) -> bool:
+    ''' Whether the given sizes exist in every format, i.e. the urls handed out for them are final '''
+    return all(_variant_exists(_variant_name(picture, size, fmt)) for size in sizes for fmt in VARIANT_FORMATS)
+
+
+@app.template_global()
+def profile_pic_url(picture: str, size: str = 'sm', fmt: str = 'jpg') -> str:
+    ''' URL of a picture variant, the original file until the variant has been generated '''
+    name = _variant_name(picture, size, fmt)
+    if _variant_exists(name):
+        return url_for('static', filename=f"{VARIANT_DIR}/{name}")
+    return url_for('static', filename=f"{PICTURE_DIR}/{picture}")
+
+
+@app.template_global()
+def profile_pic_srcset(picture: str, size: str = 'sm', fmt: str = 'jpg') -> str:
+    ''' srcset with the next size up as the 2x candidate when it exists '''
+    srcset = profile_pic_url(picture, size, fmt)
+    retina = RETINA_SIZES.get(size)
+    if retina and _variant_exists(_variant_name(picture, retina, fmt)):
+        srcset += f", {profile_pic_url(picture, retina, fmt)} 2x"
+    return srcset
+
+
+@app.cli.command('generate-image-variants')
+def generate_image_variants():
+    ''' Render the variants of every stored profile picture that is still missing some '''
+    count = 0
+    for picture in sorted(os.listdir(_static_path(PICTURE_DIR))):
+        pic_path = _static_path(PICTURE_DIR, picture)
+        if not os.path.isfile(pic_path) or picture.endswith('.part'):
+            continue
+        if _has_all_variants(picture):
+            continue
+        generate_variants(pic_path)
+        count += 1
+    click.echo(f"Generated variants for {count} picture(s).")
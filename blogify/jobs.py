@@ -0,0 +1,180 @@
+import os
+import hashlib
+import secrets
+import multiprocessing
+from datetime import datetime, timedelta
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from sqlalchemy import func
+from blogify import app, db
+from blogify.models import Post, ReportJob
+from blogify.forksafe import ForkSafeLazy
+
+
+# -- Background report jobs --
+# Reports are rendered by a local pool of worker processes (matplotlib is CPU bound and not
+# thread safe), the request only records a ReportJob row and returns its id. Job state lives in
+# the database so any web worker can answer status and download requests for it.
+#
+# Finished files double as a cache: a job is keyed by (username, report type, data version),
+# where the data version is a fingerprint of cheap aggregates over the author's posts. Edits and
+# counter changes stamp post.date_updated, so its maximum also catches changes that leave the sums
+# alone (a like moving from one post to another, an edited title). Asking again for unchanged data
+# returns the existing job instead of rendering a new file, and the least recently used files are
+# evicted once REPORT_CACHE_MAX_BYTES is exceeded.
+
+REPORT_FORMATS = {
+    'pdf': ('pdf', 'application/pdf'),
+    'csv': ('csv', 'text/csv'),
+    'excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+# spawn, so the workers never inherit open database connections or locks from this process
+_executor = ForkSafeLazy(lambda: ProcessPoolExecutor(max_workers=app.config['REPORT_WORKERS'],
+                                                     mp_context=multiprocessing.get_context('spawn')))
+
+
+def _submit(fn, *args):
+    for attempt in range(2):
+        executor = _executor.get()
+        try:
+            return executor.submit(fn, *args)
+        except BrokenProcessPool:
+            # a worker process died (out of memory, a crash in matplotlib) and the pool never recovers
+            # from that, start a new one for this and every later job
+            _executor.discard(executor)
+            executor.shutdown(wait=False)
+            if attempt:
+                raise
+
+
+def report_dir() -> str:
+    path = app.config['REPORT_DIR'] or os.path.join(app.instance_path, 'reports')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def report_path(job: ReportJob) -> str:
+    return os.path.join(report_dir(), job.filename)
+
+
+def _render_report(report_type: str, data: dict, engagement_data: dict, path: str):
+    ''' Runs inside a worker process, the reporting stack is only imported there '''
+    from blogify import report
+
+    if report_type == 'csv':
+        buffer = report.generate_csv_report(data)
+    elif report_type == 'excel':
+        buffer = report.generate_excel_report(data)
+    else:
+        buffer = report.generate_pdf_report(data, engagement_data)
+
+    # write to a temporary name first so a half written file is never served
+    with open(path + '.part', 'wb') as f:
+        f.write(buffer.getbuffer())
+    os.replace(path + '.part', path)
+
+
+def _finish_job(job_id: str, future):
+    with app.app_context():
+        job = db.session.get(ReportJob, job_id)
+        if job is None:
+            return
+        error = future.exception()
+        if error is None:
+            job.status = 'done'
+        else:
+            job.status = 'failed'
+            job.error = str(error)
+            app.logger.error("Report job %s failed: %s", job_id, error)
+        job.date_finished = datetime.utcnow()
+        db.session.commit()
+        evict_report_cache()
+
+
+def report_data_version(user) -> str:
+    ''' Fingerprint of everything a report shows, from one aggregate query instead of loading the posts '''
+    signals = db.session.query(
+        func.count(Post.id), func.max(Post.id), func.max(Post.date_posted), func.max(Post.date_updated),
+        func.sum(Post.likes_count), func.sum(Post.dislikes_count),
+    ).filter(Post.user_id == user.id).one()
+    fingerprint = repr((user.username, user.email, *signals))
+    return hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()
+
+
+def cached_report_job(username: str, report_type: str, data_version: str):
+    ''' A finished (or still running) job for exactly this data, None on a cache miss '''
+    # a job queued long ago most likely died with its worker, render it again rather than waiting forever
+    stale = datetime.utcnow() - timedelta(seconds=app.config['REPORT_JOB_TIMEOUT'])
+    job = ReportJob.query.filter_by(username=username, report_type=report_type, data_version=data_version)\
+        .filter((ReportJob.status == 'done') | ((ReportJob.status == 'queued') & (ReportJob.date_created > stale)))\
+        .order_by(ReportJob.date_created.desc())\
+        .first()
+    if job is None or (job.status == 'done' and not os.path.exists(report_path(job))):
+        return None
+    touch_report_job(job)
+    return job
+
+
+def touch_report_job(job: ReportJob):
+    job.date_accessed = datetime.utcnow()
+    db.session.commit()
+
+
+def submit_report_job(username: str, report_type: str, data_version: str, data: dict, engagement_data: dict) -> ReportJob:
+    ''' Queue a report for rendering and return its job right away '''
+    prune_report_jobs()
+
+    job_id = secrets.token_hex(16)
+    extension, _ = REPORT_FORMATS[report_type]
+    job = ReportJob(id=job_id, username=username, report_type=report_type, data_version=data_version,
+                    filename=f"{job_id}.{extension}")
+    db.session.add(job)
+    db.session.commit()
+
+    try:
+        future = _submit(_render_report, report_type, data, engagement_data, report_path(job))
+    except Exception as e:
+        # otherwise cached_report_job hands out the never started job until it counts as stale
+        job.status = 'failed'
+        job.error = str(e)
+        job.date_finished = datetime.utcnow()
+        db.session.commit()
+        raise
+    future.add_done_callback(partial(_finish_job, job_id))
+    return job
+
+
+def _delete_report_jobs(jobs):
+    for job in jobs:
+        try:
+            os.remove(report_path(job))
+        except FileNotFoundError:
+            pass
+        db.session.delete(job)
+    if jobs:
+        db.session.commit()
+
+
+def prune_report_jobs():
+    ''' Drop jobs (and their files) that were not used for REPORT_JOB_TTL seconds '''
+    cutoff = datetime.utcnow() - timedelta(seconds=app.config['REPORT_JOB_TTL'])
+    _delete_report_jobs(ReportJob.query.filter(ReportJob.date_accessed < cutoff).all())
+
+
+def evict_report_cache():
+    ''' Delete least recently used report files until the cache fits in REPORT_CACHE_MAX_BYTES '''
+    max_bytes = app.config['REPORT_CACHE_MAX_BYTES']
+    jobs = ReportJob.query.filter_by(status='done').order_by(ReportJob.date_accessed.desc()).all()
+
+    total, evicted = 0, []
+    for job in jobs:
+        try:
+            total += os.path.getsize(report_path(job))
+        except FileNotFoundError:
+            evicted.append(job)
+            continue
+        if total > max_bytes:
+            evicted.append(job)
+    _delete_report_jobs(evicted)
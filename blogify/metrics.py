@@ -0,0 +1,185 @@
+import os
+import time
+import threading
+from bisect import bisect_left
+from flask import g, request, abort, Response, before_render_template, template_rendered
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from blogify import app
+from blogify.query_budget import statement_count
+
+
+# -- Request metrics --
+# Per endpoint histograms of latency, SQL statements, template render time and response size,
+# kept in memory and served in the Prometheus text format on /metrics. The numbers are per
+# worker process, Prometheus tells the workers apart by the `pid` label. With
+# SLOW_REQUEST_SECONDS set, requests slower than that are logged together with their queries.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+SLOW_LOG_QUERIES = 20       # statements kept per request for the slow request log
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series = {}           # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def expose(self, extra_labels=()) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            labels = key + tuple(extra_labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(labels + (('le', _number(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(labels + (('le', '+Inf'),))} {values[-1]}")
+            lines.append(f"{self.name}_sum{_labels(labels)} {_number(values[-2])}")
+            lines.append(f"{self.name}_count{_labels(labels)} {values[-1]}")
+        return lines
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(labels) -> str:
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels) + '}'
+
+
+request_duration = Histogram('blogify_request_duration_seconds', 'Time spent handling a request.', LATENCY_BUCKETS)
+sql_statements = Histogram('blogify_request_sql_statements', 'SQL statements executed per request.', STATEMENT_BUCKETS)
+sql_duration = Histogram('blogify_request_sql_seconds', 'Time spent in SQL statements per request.', LATENCY_BUCKETS)
+render_duration = Histogram('blogify_request_render_seconds', 'Time spent rendering templates per request.', LATENCY_BUCKETS)
+response_size = Histogram('blogify_response_size_bytes', 'Size of response bodies (streamed ones excluded).', SIZE_BUCKETS)
+HISTOGRAMS = (request_duration, sql_statements, sql_duration, render_duration, response_size)
+
+
+# -- Collection --
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _statement_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _statement_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('metrics_started')
+    if not started or 'metrics_start' not in g:
+        if started:
+            started.pop()
+        return
+    elapsed = time.perf_counter() - started.pop()
+    g.sql_time = g.get('sql_time', 0.0) + elapsed
+    if app.config['SLOW_REQUEST_SECONDS']:
+        queries = g.setdefault('sql_log', [])
+        if len(queries) < SLOW_LOG_QUERIES:
+            queries.append((elapsed, statement))
+
+
+@before_render_template.connect_via(app)
+def _render_started(sender, template, context, **extra):
+    if 'metrics_start' in g:
+        g.setdefault('render_started', []).append(time.perf_counter())
+
+
+@template_rendered.connect_via(app)
+def _render_finished(sender, template, context, **extra):
+    started = g.get('render_started')
+    if started:
+        elapsed = time.perf_counter() - started.pop()
+        if not started:
+            # a template rendered while rendering another one is already part of the outer one's time
+            g.render_time = g.get('render_time', 0.0) + elapsed
+
+
+@app.before_request
+def _start_request_timer():
+    if app.config['METRICS_ENABLED']:
+        g.metrics_start = time.perf_counter()
+
+
+@app.after_request
+def _record_request(response):
+    start = g.get('metrics_start')
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    endpoint = request.endpoint or 'unmatched'
+    request_duration.observe(elapsed, endpoint=endpoint, method=request.method, status=str(response.status_code))
+    sql_statements.observe(statement_count(), endpoint=endpoint)
+    sql_duration.observe(g.get('sql_time', 0.0), endpoint=endpoint)
+    render_duration.observe(g.get('render_time', 0.0), endpoint=endpoint)
+    if not response.is_streamed and response.content_length is not None:
+        response_size.observe(response.content_length, endpoint=endpoint)
+
+    threshold = app.config['SLOW_REQUEST_SECONDS']
+    if threshold and elapsed > threshold:
+        queries = ''.join(f"\n  {seconds * 1000:8.1f} ms  {' '.join(statement.split())}"
+                          for seconds, statement in sorted(g.get('sql_log', ()), reverse=True))
+        app.logger.warning("Slow request %s %s (%s): %.0f ms, %d SQL statements in %.0f ms, render %.0f ms%s",
+                           request.method, request.full_path.rstrip('?'), endpoint, elapsed * 1000, statement_count(),
+                           g.get('sql_time', 0.0) * 1000, g.get('render_time', 0.0) * 1000, queries)
+    return response
+
+
+# -- Exposition --
+
+def _cache_lines(pid) -> list:
+    from blogify.cache import response_cache
+    from blogify.fragments import fragment_cache
+    from blogify.models import user_cache
+    lines = []
+    caches = {'response': response_cache, 'fragment': fragment_cache, 'user': user_cache}
+    stats = {name: cache.stats() for name, cache in caches.items() if hasattr(cache, 'stats')}
+    for metric, key, kind, help in (('blogify_cache_hits_total', 'hits', 'counter', 'Cache lookups that found an entry.'),
+                                    ('blogify_cache_misses_total', 'misses', 'counter', 'Cache lookups that found nothing.'),
+                                    ('blogify_cache_entries', 'entries', 'gauge', 'Entries currently cached.'),
+                                    ('blogify_cache_bytes', 'bytes', 'gauge', 'Approximate size of the cached entries.')):
+        lines += [f"# HELP {metric} {help}", f"# TYPE {metric} {kind}"]
+        lines += [f"{metric}{_labels((('cache', name), pid))} {values[key]}" for name, values in stats.items()]
+    return lines
+
+
+def render_metrics() -> str:
+    pid = ('pid', str(os.getpid()))
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines += histogram.expose(extra_labels=(pid,))
+    lines += _cache_lines(pid)
+    return '\n'.join(lines) + '\n'
+
+
+def _authorized() -> bool:
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') == f"Bearer {token}":
+        return True
+    return current_user.is_authenticated and current_user.username == 'admin'
+
+
+@app.route("/metrics")
+def metrics():
+    # scrapers authenticate with "Authorization: Bearer <METRICS_TOKEN>", people by logging in as admin
+    if not _authorized():
+        abort(403)
+    return Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
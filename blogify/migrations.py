@@ -0,0 +1,76 @@
+import click
+from sqlalchemy import inspect
+from blogify import app, db
+
+
+# -- Schema migrations --
+# db.create_all() only creates missing tables, it never changes existing ones. Changes to existing
+# tables are listed here in order; each one checks the schema itself before altering anything, so
+# it is a no-op on a database that create_all() just made with the current models. The names of
+# the applied ones are kept in schema_migration.
+
+def _columns(connection, table: str) -> set:
+    return {column['name'] for column in inspect(connection).get_columns(table)}
+
+
+def add_post_excerpt(connection):
+    from blogify.models import EXCERPT_LENGTH
+    if 'excerpt' not in _columns(connection, 'post'):
+        connection.exec_driver_sql(f"ALTER TABLE post ADD COLUMN excerpt VARCHAR({EXCERPT_LENGTH}) NOT NULL DEFAULT ''")
+    connection.exec_driver_sql(f"UPDATE post SET excerpt = substr(content, 1, {EXCERPT_LENGTH}) WHERE excerpt = ''")
+
+
+def add_route_indexes(connection):
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_post_date_posted_id ON post (date_posted, id)")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_post_user_id_date_posted_id ON post (user_id, date_posted, id)")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_post_reaction_user_id_post_id ON post_reaction (user_id, post_id)")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_report_job_date_accessed ON report_job (date_accessed)")
+    # give the planner statistics for the new indexes
+    connection.exec_driver_sql("ANALYZE")
+
+
+def add_trending_score(connection):
+    from blogify.models import TrendingState
+    from blogify.trending import rebuild_scores
+    if 'trending_score' not in _columns(connection, 'post'):
+        connection.exec_driver_sql("ALTER TABLE post ADD COLUMN trending_score FLOAT NOT NULL DEFAULT 0")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_post_trending_score_id ON post (trending_score, id)")
+    TrendingState.__table__.create(connection, checkfirst=True)
+    rebuild_scores(connection)
+
+
+def add_post_date_updated(connection):
+    if 'date_updated' not in _columns(connection, 'post'):
+        connection.exec_driver_sql("ALTER TABLE post ADD COLUMN date_updated DATETIME NOT NULL DEFAULT '1970-01-01 00:00:00'")
+    connection.exec_driver_sql("UPDATE post SET date_updated = date_posted WHERE date_updated = '1970-01-01 00:00:00'")
+
+
+MIGRATIONS = [
+    ('0001_add_post_excerpt', add_post_excerpt),
+    ('0002_add_route_indexes', add_route_indexes),
+    ('0003_add_trending_score', add_trending_score),
+    ('0004_add_post_date_updated', add_post_date_updated),
+]
+
+
+def upgrade() -> list:
+    ''' Apply every migration that has not been applied yet, returns their names '''
+    applied = []
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE IF NOT EXISTS schema_migration (name VARCHAR(80) PRIMARY KEY)")
+        done = {row[0] for row in connection.exec_driver_sql("SELECT name FROM schema_migration")}
+        for name, migration in MIGRATIONS:
+            if name in done:
+                continue
+            migration(connection)
+            connection.exec_driver_sql("INSERT INTO schema_migration (name) VALUES (?)", (name,))
+            applied.append(name)
+    return applied
+
+
+@app.cli.command('upgrade-db')
+def upgrade_db():
+    ''' Create missing tables and apply pending schema migrations '''
+    db.create_all()
+    applied = upgrade()
+    click.echo(f"Applied {len(applied)} migration(s){': ' + ', '.join(applied) if applied else ''}.")
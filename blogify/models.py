@@ -1,12 +1,59 @@
+import secrets
 from blogify import db, login_manager, app
 from datetime import datetime
+from flask import session, has_request_context
+from sqlalchemy.orm import validates, make_transient_to_detached
 from flask_login import UserMixin   # provides default methods for login which flask_login expects to have 
+from flask_login import user_logged_in
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer 
+from blogify.cache import LocalCache
+
+
+# -- Logged in user cache --
+# The column values of recently seen users are kept per process. On a hit they are attached to the
+# request's session without a SELECT (merge with load=False), so current_user behaves like a
+# loaded row: relationships still lazy load and changes made to it are committed as usual.
+#
+# Entries are keyed on a revision kept in the (signed) session cookie. It is regenerated at login
+# and whenever the session changes its user, so the session making a change sees it on every
+# worker process right away. Other sessions of the same user read the old values on the other
+# workers until USER_CACHE_TTL runs out.
+
+user_cache = LocalCache(max_entries=app.config['USER_CACHE_MAX_ENTRIES'], max_bytes=64 * 1024 * 1024)
+
+_USER_COLUMNS = ('id', 'username', 'email', 'profile_pic', 'password')
+
+
+def _new_revision():
+    session['user_revision'] = secrets.token_hex(4)
+
+
+@user_logged_in.connect_via(app)
+def _logged_in(sender, user):
+    _new_revision()
+
+
+def forget_user(user_id: int):
+    ''' Drop a user from the cache, call after committing changes to them '''
+    user_cache.invalidate(f"user:{user_id}")
+    if has_request_context():
+        _new_revision()
 
 
 @login_manager.user_loader
 def load_user(user_id: int):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    key = f"user:{user_id}:{session.get('user_revision', '')}"
+    values = user_cache.get(key)
+    if values is None:
+        user = db.session.get(User, user_id)
+        if user is not None:
+            user_cache.set(key, {column: getattr(user, column) for column in _USER_COLUMNS},
+                           ttl=app.config['USER_CACHE_TTL'], tags=(f"user:{user_id}",))
+        return user
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
 
 # -- SQL models or data classes --
 class User(db.Model, UserMixin):
@@ -33,16 +80,39 @@ class User(db.Model, UserMixin):
     def __repr__(self):
         return f"User({self.id}, {self.username}, {self.email}, {self.profile_pic if self.profile_pic.startswith('http') else 'default.jpg'})"
 
+EXCERPT_LENGTH = 200
+
 class Post(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(150), nullable=False)
     date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    date_updated = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)    # last edit or counter change
     content = db.Column(db.Text, nullable=False)
+    excerpt = db.Column(db.String(EXCERPT_LENGTH), nullable=False, default='')    # what the feed cards show
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     
     likes_count = db.Column(db.Integer, default=0)     # Likes counter
     dislikes_count = db.Column(db.Integer, default=0)  # Dislikes counter
+    trending_score = db.Column(db.Float, nullable=False, default=0.0)     # see blogify/trending.py
+
+    # the feeds walk posts newest first, overall and per author (see benchmarks/query_plans.py)
+    __table_args__ = (db.Index('ix_post_date_posted_id', 'date_posted', 'id'),
+                      db.Index('ix_post_user_id_date_posted_id', 'user_id', 'date_posted', 'id'),
+                      db.Index('ix_post_trending_score_id', 'trending_score', 'id'))
 
+    @validates('content')
+    def _update_excerpt(self, key, content):
+        self.excerpt = content[:EXCERPT_LENGTH] if content else ''
+        return content
+
+    @staticmethod
+    def feed_query(with_content: bool = False):
+        '''
+        Posts with their author loaded in the same SELECT, every card shows the author's name and picture.
+        The cards only show the excerpt, so unless asked for the full content is loaded on first access.
+        '''
+        query = Post.query.options(db.joinedload(Post.author))
+        return query if with_content else query.options(db.defer(Post.content))
 
     def __repr__(self):
         return f"Post({self.title}, {self.date_posted})"
@@ -54,7 +124,67 @@ class PostReaction(db.Model):
     reaction_type = db.Column(db.String(10), nullable=False)  # 'like' or 'dislike'
     date_reacted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
-    __table_args__ = (db.UniqueConstraint('post_id', 'user_id', name='unique_post_reaction'),)
+    __table_args__ = (db.UniqueConstraint('post_id', 'user_id', name='unique_post_reaction'),
+                      db.Index('ix_post_reaction_user_id_post_id', 'user_id', 'post_id'))
+
+    def __repr__(self):
+        return f"PostReaction(post_id={self.post_id}, user_id={self.user_id}, reaction_type={self.reaction_type})"
+
+class ReportJob(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    username = db.Column(db.String(20), nullable=False)
+    report_type = db.Column(db.String(10), nullable=False)
+    data_version = db.Column(db.String(40), nullable=False, index=True)     # fingerprint of the data it was built from
+    status = db.Column(db.String(10), nullable=False, default='queued')    # 'queued', 'done' or 'failed'
+    filename = db.Column(db.String(120))
+    error = db.Column(db.Text)
+    date_created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    date_finished = db.Column(db.DateTime)
+    date_accessed = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)   # for LRU eviction
+
+    def __repr__(self):
+        return f"ReportJob({self.id}, {self.username}, {self.report_type}, {self.status})"
+
+class MailOutbox(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255), nullable=False)
+    sender = db.Column(db.String(120), nullable=False)
+    recipients = db.Column(db.Text, nullable=False)     # JSON list
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    status = db.Column(db.String(10), nullable=False, default='queued')    # 'queued', 'sent' or 'failed'
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    last_error = db.Column(db.Text)
+    date_created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    date_sent = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f"MailOutbox({self.id}, {self.subject}, {self.status}, attempts={self.attempts})"
+
+class TrendingState(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    epoch = db.Column(db.Float, nullable=False)      # unix time the stored trending scores are relative to
+
+    def __repr__(self):
+        return f"TrendingState(epoch={self.epoch})"
+
+
+# -- Daily reaction rollups, kept up to date by blogify.rollups --
+class PostDailyReactions(db.Model):
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    likes = db.Column(db.Integer, nullable=False, default=0)
+    dislikes = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"PostDailyReactions(post_id={self.post_id}, day={self.day}, likes={self.likes}, dislikes={self.dislikes})"
+
+class AuthorDailyReactions(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    likes = db.Column(db.Integer, nullable=False, default=0)
+    dislikes = db.Column(db.Integer, nullable=False, default=0)
 
     def __repr__(self):
-        return f"PostReaction(post_id={self.post_id}, user_id={self.user_id}, reaction_type={self.reaction_type})"
\ No newline at end of file
+        return f"AuthorDailyReactions(user_id={self.user_id}, day={self.day}, likes={self.likes}, dislikes={self.dislikes})"
@@ -0,0 +1,143 @@
+import json
+import threading
+import click
+from datetime import datetime, timedelta
+from email.utils import formataddr
+from sqlalchemy import update, delete, select
+from flask_mail import Message
+from blogify import app, db, mail
+from blogify.models import MailOutbox
+from blogify.forksafe import ForkSafeLazy, start_daemon
+
+
+# -- Mail outbox --
+# Requests only insert the message into mail_outbox. A daemon thread, started by the first request
+# every worker process serves, claims due messages in batches and sends each batch over a single
+# SMTP connection. It also polls every MAIL_OUTBOX_INTERVAL seconds, so messages left over from
+# before a restart or waiting out a backoff go out without a new message waking it. Claiming
+# pushes next_attempt forward by the lease, so two workers never pick the same message and one
+# claimed by a worker that died is simply picked up again once the lease runs out. Failures are
+# retried after MAIL_RETRY_BACKOFF * 2^(attempts - 1) seconds.
+
+CLAIM_LEASE = timedelta(minutes=5)
+KEEP_SENT = timedelta(days=7)
+
+
+def queue_mail(msg: Message):
+    ''' Commit a message to the outbox and wake the sender, returns right away '''
+    sender = msg.sender if isinstance(msg.sender, str) else formataddr(msg.sender)
+    db.session.add(MailOutbox(subject=msg.subject, sender=sender, recipients=json.dumps(list(msg.recipients)),
+                              body=msg.body, html=msg.html))
+    db.session.commit()
+    mail_sender.get().wake()
+
+
+def _claim(batch_size: int) -> list:
+    now = datetime.utcnow()
+    due = select(MailOutbox.id).filter(MailOutbox.status == 'queued', MailOutbox.next_attempt <= now)\
+        .order_by(MailOutbox.id).limit(batch_size)
+    rows = db.session.execute(
+        update(MailOutbox)
+        .where(MailOutbox.id.in_(due.scalar_subquery()), MailOutbox.next_attempt <= now)
+        .values(attempts=MailOutbox.attempts + 1, next_attempt=now + CLAIM_LEASE)
+        .returning(MailOutbox.id, MailOutbox.subject, MailOutbox.sender, MailOutbox.recipients,
+                   MailOutbox.body, MailOutbox.html, MailOutbox.attempts)
+    ).all()
+    db.session.commit()
+    return sorted(rows, key=lambda row: row.id)
+
+
+def _failed(row, error: Exception):
+    values = {'last_error': f"{type(error).__name__}: {error}"}
+    if row.attempts >= app.config['MAIL_MAX_ATTEMPTS']:
+        values['status'] = 'failed'
+        app.logger.error("Giving up on mail %s to %s: %s", row.id, row.recipients, error)
+    else:
+        backoff = app.config['MAIL_RETRY_BACKOFF'] * 2 ** (row.attempts - 1)
+        values['next_attempt'] = datetime.utcnow() + timedelta(seconds=backoff)
+    db.session.execute(update(MailOutbox).filter_by(id=row.id).values(**values))
+
+
+def deliver_pending(batch_size: int = None) -> int:
+    ''' Send one batch of due messages over one connection, returns how many were sent '''
+    rows = _claim(batch_size or app.config['MAIL_OUTBOX_BATCH'])
+    if not rows:
+        return 0
+    sent = 0
+    try:
+        with mail.connect() as connection:
+            for row in rows:
+                msg = Message(row.subject, sender=row.sender, recipients=json.loads(row.recipients),
+                              body=row.body, html=row.html)
+                try:
+                    connection.send(msg)
+                except Exception as e:
+                    _failed(row, e)
+                else:
+                    db.session.execute(update(MailOutbox).filter_by(id=row.id)
+                                       .values(status='sent', date_sent=datetime.utcnow(), last_error=None))
+                    sent += 1
+                db.session.commit()
+    except Exception as e:
+        # connecting (or closing) failed, everything still marked as claimed goes back with a backoff
+        db.session.rollback()
+        unsent = db.session.execute(select(MailOutbox.id).filter(
+            MailOutbox.id.in_([row.id for row in rows]), MailOutbox.status == 'queued')).scalars().all()
+        for row in rows:
+            if row.id in unsent:
+                _failed(row, e)
+        db.session.commit()
+    return sent
+
+
+def prune_outbox():
+    db.session.execute(delete(MailOutbox).filter(MailOutbox.status == 'sent',
+                                                 MailOutbox.date_sent < datetime.utcnow() - KEEP_SENT))
+    db.session.commit()
+
+
+class MailSender:
+    ''' Daemon thread delivering the outbox, woken right after a message is queued '''
+
+    def __init__(self):
+        self._wakeup = threading.Event()
+        self._thread = start_daemon(self._run, 'mail-sender')
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(app.config['MAIL_OUTBOX_INTERVAL'])
+            self._wakeup.clear()
+            try:
+                with app.app_context():
+                    # keep going while full batches come back, there may be more waiting
+                    while deliver_pending() >= app.config['MAIL_OUTBOX_BATCH']:
+                        pass
+                    prune_outbox()
+            except Exception:
+                app.logger.exception("Delivering the mail outbox failed")
+
+
+# one sender per (forked) worker process
+mail_sender = ForkSafeLazy(MailSender)
+
+
+@app.before_request
+def _start_mail_sender():
+    mail_sender.get()
+
+
+@app.cli.command('send-mail')
+def send_mail():
+    ''' Deliver every message that is due now, e.g. after the server was down '''
+    total = 0
+    while True:
+        sent = deliver_pending()
+        total += sent
+        if sent == 0:
+            break
+    prune_outbox()
+    failed = MailOutbox.query.filter_by(status='failed').count()
+    click.echo(f"Sent {total} message(s), {failed} failed permanently.")
@@ -0,0 +1,98 @@
+from datetime import datetime
+from itsdangerous import URLSafeSerializer, BadSignature
+from sqlalchemy import tuple_, func
+from blogify import app
+
+
+# -- Keyset (cursor) pagination --
+# Instead of OFFSET + COUNT(*) every page is fetched with a "WHERE key < last_key" range
+# on an indexed ordering, so page N costs the same as page 1.
+
+def _serializer():
+    return URLSafeSerializer(app.config['SECRET_KEY'], salt='feed-cursor')
+
+
+def _dump_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _load_value(value):
+    if isinstance(value, dict) and 'dt' in value:
+        return datetime.fromisoformat(value['dt'])
+    return value
+
+
+def encode_cursor(values, direction: str) -> str:
+    ''' Pack the key of a row and the paging direction into an opaque, signed token '''
+    return _serializer().dumps({'k': [_dump_value(v) for v in values], 'd': direction})
+
+
+def decode_cursor(token: str):
+    ''' Returns (key values, direction) or None if the token is missing or was tampered with '''
+    if not token:
+        return None
+    try:
+        data = _serializer().loads(token)
+        return [_load_value(v) for v in data['k']], data['d']
+    except (BadSignature, KeyError, TypeError, ValueError):
+        return None
+
+
+class KeysetPage:
+    ''' One page of results, exposes the same `items` attribute templates use with Pagination '''
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total                  # only filled in when the caller explicitly asks for it
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self) -> bool:
+        return self.prev_cursor is not None
+
+
+def keyset_paginate(query, keys, cursor: str = None, per_page: int = 5, descending: bool = True,
+                    key_of=None, with_total: bool = False) -> KeysetPage:
+    '''
+    Paginate `query` ordered by the tuple of columns in `keys` (last one must be unique, e.g. the id).
+    `key_of(item)` returns the key values of a result row, defaults to reading the column names off the item.
+    '''
+    if key_of is None:
+        key_of = lambda item: [getattr(item, col.key) for col in keys]
+
+    # count the matching rows only, Query.count() would wrap the full entity SELECT (every column) in a subquery
+    total = query.enable_eagerloads(False).with_entities(func.count()).order_by(None).scalar() if with_total else None
+
+    decoded = decode_cursor(cursor)
+    direction = decoded[1] if decoded else 'next'
+    # walking backwards is the same range query with the comparison and ordering flipped
+    walk_desc = (direction == 'next') == descending
+
+    if decoded:
+        key_tuple = tuple_(*keys)
+        query = query.filter(key_tuple < tuple_(*decoded[0]) if walk_desc else key_tuple > tuple_(*decoded[0]))
+
+    ordering = [col.desc() if walk_desc else col.asc() for col in keys]
+    rows = query.order_by(*ordering).limit(per_page + 1).all()
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == 'prev':
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        # there is always something behind us if we arrived through a cursor
+        if (direction == 'next' and has_more) or (direction == 'prev' and decoded):
+            next_cursor = encode_cursor(key_of(rows[-1]), 'next')
+        if (direction == 'prev' and has_more) or (direction == 'next' and decoded):
+            prev_cursor = encode_cursor(key_of(rows[0]), 'prev')
+
+    return KeysetPage(rows, next_cursor=next_cursor, prev_cursor=prev_cursor, total=total)
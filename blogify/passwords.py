@@ -0,0 +1,52 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from werkzeug.exceptions import ServiceUnavailable
+from blogify import app, bcrypt
+from blogify.forksafe import ForkSafeLazy
+
+
+# -- Password hashing --
+# bcrypt is deliberately slow, a burst of logins would otherwise keep every worker thread busy
+# hashing. All hashing goes through a small pool (bcrypt releases the GIL while it works), and a
+# semaphore bounds how many requests may be waiting for it; beyond that they fail fast with a 503
+# instead of piling up.
+
+def _start_pool():
+    ''' The hashing pool and the semaphore bounding its queue '''
+    workers = app.config['PASSWORD_HASH_WORKERS']
+    return (ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash'),
+            threading.BoundedSemaphore(workers * 4))
+
+
+_pool = ForkSafeLazy(_start_pool)
+
+
+def _run(fn, *args):
+    executor, slots = _pool.get()
+    timeout = app.config['PASSWORD_HASH_TIMEOUT']
+    busy = ServiceUnavailable("Too many sign ins at the moment, please try again shortly.")
+    if not slots.acquire(timeout=timeout):
+        raise busy
+    # the slot is only given back once the hash is done, even if this request stopped waiting for it
+    future = executor.submit(fn, *args)
+    future.add_done_callback(lambda _: slots.release())
+    try:
+        return future.result(timeout=timeout)
+    except TimeoutError:
+        raise busy
+
+
+def hash_password(password: str) -> str:
+    return _run(bcrypt.generate_password_hash, password, app.config['BCRYPT_LOG_ROUNDS']).decode('utf-8')
+
+
+def check_password(pw_hash: str, password: str) -> bool:
+    return _run(bcrypt.check_password_hash, pw_hash, password)
+
+
+def needs_rehash(pw_hash: str) -> bool:
+    ''' Whether a stored hash ($2b$<rounds>$...) was made with a different work factor than the current one '''
+    try:
+        return int(pw_hash.split('$')[2]) != app.config['BCRYPT_LOG_ROUNDS']
+    except (IndexError, ValueError):
+        return True
@@ -0,0 +1,41 @@
+from functools import wraps
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from blogify import app
+
+
+# -- Per request SQL statement budget --
+# Every statement executed while handling a request is counted. Routes decorated with
+# @query_budget(n) fail loudly in testing (or with QUERY_BUDGET_STRICT=True) and log a warning
+# otherwise when they go over n, which keeps N+1 query patterns from sneaking back in.
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.sql_statements = g.get('sql_statements', 0) + 1
+
+
+def statement_count() -> int:
+    ''' Number of SQL statements run so far in the current request '''
+    return g.get('sql_statements', 0)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(max_queries: int):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            response = view(*args, **kwargs)
+            used = statement_count()
+            if used > max_queries:
+                message = f"{request.endpoint} ran {used} SQL statements, its budget is {max_queries}"
+                if app.config.get('QUERY_BUDGET_STRICT', app.testing):
+                    raise QueryBudgetExceeded(message)
+                app.logger.warning(message)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,192 @@
+import atexit
+import threading
+import time
+import click
+from datetime import datetime
+from sqlalchemy import update, delete, select, func
+from sqlalchemy.exc import IntegrityError
+from blogify import app, db
+from blogify.models import Post, PostReaction
+from blogify.rollups import record_reaction_changes
+from blogify.trending import record_trending_changes
+from blogify.forksafe import ForkSafeLazy, reset_after_fork, start_daemon
+
+
+# -- Reaction counters --
+# post.likes_count / post.dislikes_count are only ever changed with "SET x = x + delta" statements,
+# and only by the delta that the PostReaction insert/update/delete actually applied, so concurrent
+# workers can not lose updates. With REACTION_COUNTER_WRITE_BEHIND the deltas are summed in memory
+# and flushed in one batch every REACTION_FLUSH_INTERVAL seconds instead of on every click.
+
+_DELTAS = {'like': (1, 0), 'dislike': (0, 1)}
+
+
+def _change_reaction(post_id: int, user_id: int, reaction_type: str):
+    ''' Applies the toggle to post_reaction and returns the (time reacted, likes, dislikes) deltas it caused '''
+    existing = db.session.execute(
+        select(PostReaction.reaction_type, PostReaction.date_reacted).filter_by(post_id=post_id, user_id=user_id)
+    ).first()
+    now = datetime.utcnow()
+
+    if existing and existing.reaction_type == reaction_type:
+        # same reaction again removes it, the rowcount guards against a concurrent request doing it first
+        result = db.session.execute(
+            delete(PostReaction).filter_by(post_id=post_id, user_id=user_id, reaction_type=reaction_type)
+        )
+        if result.rowcount == 0:
+            return []
+        likes, dislikes = _DELTAS[reaction_type]
+        return [(existing.date_reacted, -likes, -dislikes)]
+
+    if existing:
+        # switching counts as a new reaction made now
+        result = db.session.execute(
+            update(PostReaction)
+            .filter_by(post_id=post_id, user_id=user_id, reaction_type=existing.reaction_type)
+            .values(reaction_type=reaction_type, date_reacted=now)
+        )
+        if result.rowcount == 0:
+            return []
+        old_likes, old_dislikes = _DELTAS[existing.reaction_type]
+        return [(existing.date_reacted, -old_likes, -old_dislikes), (now, *_DELTAS[reaction_type])]
+
+    # the unique (post_id, user_id) constraint rejects a concurrent duplicate insert
+    db.session.add(PostReaction(post_id=post_id, user_id=user_id, reaction_type=reaction_type, date_reacted=now))
+    db.session.flush()
+    return [(now, *_DELTAS[reaction_type])]
+
+
+def _increment_counters(post_id: int, likes: int, dislikes: int):
+    return db.session.execute(
+        update(Post)
+        .where(Post.id == post_id)
+        .values(likes_count=func.coalesce(Post.likes_count, 0) + likes,
+                dislikes_count=func.coalesce(Post.dislikes_count, 0) + dislikes,
+                date_updated=datetime.utcnow())
+        .returning(Post.likes_count, Post.dislikes_count)
+    ).one()
+
+
+def react(post_id: int, author_id: int, user_id: int, reaction_type: str):
+    ''' Toggle a user's reaction on a post, returns the post's (likes, dislikes) afterwards '''
+    try:
+        changes = _change_reaction(post_id, user_id, reaction_type)
+    except IntegrityError:
+        # lost the race against another request of the same user, redo the toggle on top of its result
+        db.session.rollback()
+        changes = _change_reaction(post_id, user_id, reaction_type)
+
+    record_reaction_changes(post_id, author_id, changes)
+    record_trending_changes(post_id, changes)
+    likes = sum(change[1] for change in changes)
+    dislikes = sum(change[2] for change in changes)
+
+    if app.config.get('REACTION_COUNTER_WRITE_BEHIND'):
+        db.session.commit()
+        counter_buffer.add(post_id, likes, dislikes)
+        stored_likes, stored_dislikes = db.session.execute(
+            select(Post.likes_count, Post.dislikes_count).where(Post.id == post_id)
+        ).one()
+        pending_likes, pending_dislikes = counter_buffer.pending(post_id)
+        return (stored_likes or 0) + pending_likes, (stored_dislikes or 0) + pending_dislikes
+
+    counts = _increment_counters(post_id, likes, dislikes)
+    db.session.commit()
+    return counts.likes_count, counts.dislikes_count
+
+
+class CounterBuffer:
+    ''' Pending counter deltas per post, flushed by a daemon thread started on first use '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._deltas = {}
+        self._flusher = ForkSafeLazy(self._start)
+
+    def add(self, post_id: int, likes: int, dislikes: int):
+        if likes == 0 and dislikes == 0:
+            return
+        with self._lock:
+            pending = self._deltas.setdefault(post_id, [0, 0])
+            pending[0] += likes
+            pending[1] += dislikes
+        self._flusher.get()
+
+    def pending(self, post_id: int):
+        with self._lock:
+            return tuple(self._deltas.get(post_id, (0, 0)))
+
+    def flush(self) -> int:
+        ''' Writes all pending deltas in a single transaction, returns the number of posts updated '''
+        with self._lock:
+            deltas, self._deltas = self._deltas, {}
+        if not deltas:
+            return 0
+        # posts whose deltas cancelled out are written too, their reactions still moved between days
+        rows = [{'post_id': post_id, 'likes': likes, 'dislikes': dislikes} for post_id, (likes, dislikes) in deltas.items()]
+        post = Post.__table__
+        with app.app_context():
+            # plain table update, executed as one executemany
+            db.session.execute(
+                update(post)
+                .where(post.c.id == db.bindparam('post_id'))
+                .values(likes_count=func.coalesce(post.c.likes_count, 0) + db.bindparam('likes'),
+                        dislikes_count=func.coalesce(post.c.dislikes_count, 0) + db.bindparam('dislikes'),
+                        date_updated=datetime.utcnow()),
+                rows,
+            )
+            db.session.commit()
+        return len(rows)
+
+    def _start(self):
+        atexit.register(self.flush)
+        return start_daemon(self._run, 'reaction-counter-flush')
+
+    def _run(self):
+        while True:
+            time.sleep(app.config.get('REACTION_FLUSH_INTERVAL', 2.0))
+            try:
+                self.flush()
+            except Exception:
+                app.logger.exception("Flushing reaction counters failed")
+
+    def _after_fork(self):
+        # the deltas are the parent's to flush (also by the atexit handler the child inherits)
+        self._lock = threading.Lock()
+        self._deltas = {}
+
+
+counter_buffer = CounterBuffer()
+reset_after_fork(counter_buffer._after_fork)
+
+
+def reconcile_reaction_counts() -> int:
+    '''
+    Recompute every post's counters from post_reaction, returns how many posts had drifted.
+    Only this process' write-behind buffer is flushed first. Deltas still buffered by running web
+    workers would be added on top of the recount, so with REACTION_COUNTER_WRITE_BEHIND this has to
+    run while the workers are stopped.
+    '''
+    likes = select(func.count()).where(PostReaction.post_id == Post.id, PostReaction.reaction_type == 'like')\
+        .correlate(Post).scalar_subquery()
+    dislikes = select(func.count()).where(PostReaction.post_id == Post.id, PostReaction.reaction_type == 'dislike')\
+        .correlate(Post).scalar_subquery()
+    counter_buffer.flush()
+    result = db.session.execute(
+        update(Post)
+        .where((func.coalesce(Post.likes_count, -1) != likes) | (func.coalesce(Post.dislikes_count, -1) != dislikes))
+        .values(likes_count=likes, dislikes_count=dislikes, date_updated=datetime.utcnow()),
+        execution_options={'synchronize_session': False},
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+@app.cli.command('reconcile-reactions')
+def reconcile_reactions():
+    '''
+    Fix drifted like/dislike counters by recounting post_reaction.
+    With REACTION_COUNTER_WRITE_BEHIND, stop the web workers first, or their buffered deltas are counted twice.
+    '''
+    fixed = reconcile_reaction_counts()
+    click.echo(f"Reconciled reaction counters, {fixed} post(s) corrected.")
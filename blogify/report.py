@@ -3,7 +3,6 @@ from reportlab.platypus import Image, SimpleDocTemplate, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet
 import seaborn as sns
 import pandas as pd
-from flask import send_file
 import io
 
 import matplotlib
@@ -25,9 +24,9 @@ def generate_pdf_report(data, engagement_data):
     elements.append(Paragraph(f"Average Dislikes per Post: {data['average_dislikes']:.2f}", styles['Normal']))
 
     if data['most_liked_post']:
-        elements.append(Paragraph(f"Most Liked Post: {data['most_liked_post'].title} ({data['most_liked_post'].likes_count} likes)", styles['Normal']))
+        elements.append(Paragraph(f"Most Liked Post: {data['most_liked_post']['title']} ({data['most_liked_post']['likes']} likes)", styles['Normal']))
     if data['most_disliked_post']:
-        elements.append(Paragraph(f"Most Disliked Post: {data['most_disliked_post'].title} ({data['most_disliked_post'].dislikes_count} dislikes)", styles['Normal']))
+        elements.append(Paragraph(f"Most Disliked Post: {data['most_disliked_post']['title']} ({data['most_disliked_post']['dislikes']} dislikes)", styles['Normal']))
 
     elements.append(Spacer(1, 12))
 
@@ -52,7 +51,7 @@ def generate_pdf_report(data, engagement_data):
 
     doc.build(elements)
     buffer.seek(0)
-    return send_file(buffer, as_attachment=True, download_name=f"{data['username']}_report.pdf", mimetype='application/pdf')
+    return buffer
 
     
 def generate_csv_report(data):
@@ -60,7 +59,7 @@ def generate_csv_report(data):
     buffer = io.BytesIO()
     df.to_csv(buffer, index=False)
     buffer.seek(0)
-    return send_file(buffer, as_attachment=True, download_name=f"{data['username']}_report.csv", mimetype='text/csv')
+    return buffer
 
 def generate_excel_report(data):
     df = pd.DataFrame(data['posts'])
@@ -68,7 +67,7 @@ def generate_excel_report(data):
     with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
         df.to_excel(writer, index=False)
     buffer.seek(0)
-    return send_file(buffer, as_attachment=True, download_name=f"{data['username']}_report.xlsx", mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    return buffer
 
 def generate_engagement_over_time_chart(engagement_data):
     df = pd.DataFrame(engagement_data)
@@ -79,7 +78,7 @@ def generate_engagement_over_time_chart(engagement_data):
 
     ax.set_title('Engagement Over Time')
     ax.set_xlabel('Date')
-    ax.set_ylabel('Count')
+    ax.set_ylabel('Reactions per day')
     ax.legend()
 
     img_buffer = io.BytesIO()
@@ -0,0 +1,77 @@
+from sqlalchemy import select, func
+from blogify import db
+from blogify.models import Post
+from blogify.rollups import author_engagement_series
+
+
+# -- Report data --
+# Totals, averages and the most liked/disliked posts come out of one aggregate query. Post rows are
+# fetched as plain tuples with only the columns a report prints, the PDF only shows a short excerpt
+# of every post so only that slice of the body is transferred for it.
+
+PDF_EXCERPT_LENGTH = 50
+
+
+def _top_post(user_id: int, column):
+    ''' Scalar subquery for the title of the post with the highest `column`, latest post wins ties '''
+    return select(Post.title).where(Post.user_id == user_id)\
+        .order_by(column.desc(), Post.date_posted.desc(), Post.id.desc())\
+        .limit(1).scalar_subquery()
+
+
+def report_statistics(user_id: int) -> dict:
+    likes = func.coalesce(Post.likes_count, 0)
+    dislikes = func.coalesce(Post.dislikes_count, 0)
+    row = db.session.execute(
+        select(
+            func.count(Post.id).label('total_posts'),
+            func.coalesce(func.sum(likes), 0).label('total_likes'),
+            func.coalesce(func.sum(dislikes), 0).label('total_dislikes'),
+            func.coalesce(func.avg(likes), 0).label('average_likes'),
+            func.coalesce(func.avg(dislikes), 0).label('average_dislikes'),
+            func.max(likes).label('max_likes'),
+            func.max(dislikes).label('max_dislikes'),
+            _top_post(user_id, likes).label('most_liked_title'),
+            _top_post(user_id, dislikes).label('most_disliked_title'),
+        ).where(Post.user_id == user_id)
+    ).one()
+
+    return {
+        "total_posts": row.total_posts,
+        "total_likes": row.total_likes,
+        "total_dislikes": row.total_dislikes,
+        "average_likes": row.average_likes,
+        "average_dislikes": row.average_dislikes,
+        "most_liked_post": {"title": row.most_liked_title, "likes": row.max_likes} if row.total_posts else None,
+        "most_disliked_post": {"title": row.most_disliked_title, "dislikes": row.max_dislikes} if row.total_posts else None,
+    }
+
+
+def report_posts(user_id: int, report_type: str) -> list:
+    ''' Per post rows for the report, with the body cut down to what the given format prints '''
+    if report_type == 'pdf':
+        content = func.substr(Post.content, 1, PDF_EXCERPT_LENGTH)
+    else:
+        content = Post.content
+    rows = db.session.execute(
+        select(Post.title, Post.date_posted, content.label('content'),
+               func.coalesce(Post.likes_count, 0).label('likes'),
+               func.coalesce(Post.dislikes_count, 0).label('dislikes'))
+        .where(Post.user_id == user_id)
+        .order_by(Post.date_posted.desc())
+    )
+    return [row._asdict() for row in rows]
+
+
+def build_report_data(user, report_type: str):
+    ''' Returns (report data, engagement data) in the shape blogify.report expects '''
+    posts = report_posts(user.id, report_type)
+    report_data = {
+        "username": user.username,
+        "email": user.email,
+        **report_statistics(user.id),
+        "posts": posts,
+    }
+    # when the reactions were actually made, read from the daily rollup
+    engagement_data = author_engagement_series(user.id)
+    return report_data, engagement_data
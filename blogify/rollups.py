@@ -0,0 +1,85 @@
+import click
+from sqlalchemy import select, delete, func, case
+from sqlalchemy.dialects.sqlite import insert
+from blogify import app, db
+from blogify.models import Post, PostReaction, PostDailyReactions, AuthorDailyReactions
+
+
+# -- Daily reaction rollups --
+# Per post and per author like/dislike counts for every day, i.e. how many of the current reactions
+# were made on that day. react() feeds every change in here as it happens, so an engagement series
+# is a read of a few small rows instead of a scan over post_reaction.
+
+def _upsert(model, key: dict, likes: int, dislikes: int):
+    statement = insert(model).values(**key, likes=likes, dislikes=dislikes)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=list(key),
+        set_={'likes': model.likes + statement.excluded.likes, 'dislikes': model.dislikes + statement.excluded.dislikes},
+    ))
+
+
+def record_reaction_changes(post_id: int, author_id: int, changes):
+    ''' Add (time reacted, likes delta, dislikes delta) changes to both rollups, in the caller's transaction '''
+    for reacted, likes, dislikes in changes:
+        if likes == 0 and dislikes == 0:
+            continue
+        _upsert(PostDailyReactions, {'post_id': post_id, 'day': reacted.date()}, likes, dislikes)
+        _upsert(AuthorDailyReactions, {'user_id': author_id, 'day': reacted.date()}, likes, dislikes)
+
+
+def forget_post(post_id: int, author_id: int):
+    ''' Take a deleted post out of both rollups, in the caller's transaction, like rebuild_rollups leaves it out '''
+    rows = db.session.execute(
+        select(PostDailyReactions.day, PostDailyReactions.likes, PostDailyReactions.dislikes)
+        .where(PostDailyReactions.post_id == post_id)
+    ).all()
+    for row in rows:
+        _upsert(AuthorDailyReactions, {'user_id': author_id, 'day': row.day}, -row.likes, -row.dislikes)
+    db.session.execute(delete(PostDailyReactions).where(PostDailyReactions.post_id == post_id))
+    # a rebuild only has rows for days that still have reactions
+    db.session.execute(delete(AuthorDailyReactions).where(
+        AuthorDailyReactions.user_id == author_id, AuthorDailyReactions.likes == 0, AuthorDailyReactions.dislikes == 0))
+
+
+def author_engagement_series(user_id: int) -> dict:
+    ''' Likes and dislikes received per day, oldest first '''
+    rows = db.session.execute(
+        select(AuthorDailyReactions.day, AuthorDailyReactions.likes, AuthorDailyReactions.dislikes)
+        .where(AuthorDailyReactions.user_id == user_id)
+        .order_by(AuthorDailyReactions.day)
+    ).all()
+    return {
+        "dates": [row.day for row in rows],
+        "likes": [row.likes for row in rows],
+        "dislikes": [row.dislikes for row in rows],
+    }
+
+
+def rebuild_rollups():
+    ''' Recompute both rollup tables from post_reaction '''
+    day = func.date(PostReaction.date_reacted)
+    likes = func.sum(case((PostReaction.reaction_type == 'like', 1), else_=0))
+    dislikes = func.sum(case((PostReaction.reaction_type == 'dislike', 1), else_=0))
+
+    db.session.execute(delete(PostDailyReactions))
+    db.session.execute(delete(AuthorDailyReactions))
+    db.session.execute(insert(PostDailyReactions).from_select(
+        ['post_id', 'day', 'likes', 'dislikes'],
+        select(PostReaction.post_id, day, likes, dislikes)
+        .join(Post, Post.id == PostReaction.post_id)
+        .group_by(PostReaction.post_id, day),
+    ))
+    db.session.execute(insert(AuthorDailyReactions).from_select(
+        ['user_id', 'day', 'likes', 'dislikes'],
+        select(Post.user_id, day, likes, dislikes)
+        .join(Post, Post.id == PostReaction.post_id)
+        .group_by(Post.user_id, day),
+    ))
+    db.session.commit()
+
+
+@app.cli.command('rebuild-reaction-rollups')
+def rebuild_reaction_rollups():
+    ''' Rebuild the daily reaction rollups from the raw reactions '''
+    rebuild_rollups()
+    click.echo("Reaction rollups rebuilt.")
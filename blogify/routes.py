@@ -1,36 +1,67 @@
 import io
-import os
-import secrets
-from flask import redirect, render_template, request, url_for, flash, abort, jsonify, send_file
+from flask import redirect, render_template, request, url_for, flash, abort, jsonify, send_file, Response, stream_with_context
 from sqlalchemy.engine import url
 from datetime import datetime
-from PIL import Image
-from blogify import app, db, bcrypt, mail
+from blogify import app, db
 from blogify.forms import PostForm, RegistrationForm, LoginForm, UpdateAccountForm, RequestResetForm, ResetPasswordForm
-from blogify.models import User, Post, PostReaction
+from blogify.models import User, Post, PostReaction, forget_user
+from blogify.pagination import keyset_paginate
+from blogify.search import search_posts
+from blogify.query_budget import query_budget
+from blogify.reactions import react
+from blogify.rollups import forget_post
+from blogify.trending import trending_posts
+from blogify.images import save_picture
+from blogify.passwords import hash_password, check_password, needs_rehash
+from blogify.outbox import queue_mail
+from blogify.cache import cached_page, cache_tags, invalidate
+from blogify.database import read_only
+from blogify import fragments     # registers the post_card() template global
 from flask_login import login_user, logout_user, current_user, login_required
 from flask_mail import Message
 
 @app.route("/")
 @app.route("/home")
+@read_only
+@cached_page('cursor')
+@query_budget(3)
 def home():
-    page = request.args.get('page', 1, type=int)
-    posts = Post.query.order_by(Post.date_posted.desc()).paginate(per_page=4, page=page)
+    cursor = request.args.get('cursor')
+    posts = keyset_paginate(Post.feed_query(), (Post.date_posted, Post.id), cursor=cursor, per_page=4)
+    attach_user_reactions(posts.items)
+    cache_tags('feed', *(f"post:{post.id}" for post in posts.items), *(f"user:{post.user_id}" for post in posts.items))
     return render_template("home.html", posts=posts, title="Home")
 
 
+@app.route("/trending")
+@read_only
+@cached_page('cursor')
+@query_budget(3)
+def trending():
+    cursor = request.args.get('cursor')
+    posts = trending_posts(cursor=cursor, per_page=4)
+    attach_user_reactions(posts.items)
+    # a reaction to any post can move it onto these pages
+    cache_tags('trending', *(f"post:{post.id}" for post in posts.items), *(f"user:{post.user_id}" for post in posts.items))
+    return render_template("home.html", posts=posts, title="Trending")
+
+
 @app.route("/about")
+@cached_page()
 def about():
     return render_template("about.html", title="About")
 
 @app.route("/search")
+@read_only
+@query_budget(3)
 def search():
     query = request.args.get('query')
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     if query:
-        posts = Post.query.filter(Post.title.contains(query) | Post.content.contains(query)).paginate(page=page, per_page=5)
+        posts = search_posts(query, cursor=cursor, per_page=5)
     else:
-        posts = Post.query.paginate(page=page, per_page=5)
+        posts = keyset_paginate(Post.feed_query(), (Post.date_posted, Post.id), cursor=cursor, per_page=5)
+    attach_user_reactions(posts.items)
     return render_template('home.html', posts=posts)
 
 @app.route("/register", methods=['GET', 'POST'])
@@ -41,7 +72,7 @@ def register():
     # checks if from was validated when submitted
     if form.validate_on_submit():
         # Hash the password entered by the user
-        hashed_pw = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+        hashed_pw = hash_password(form.password.data)
         user = User(username=form.username.data, email=form.email.data, password=hashed_pw)
         db.session.add(user)
         db.session.commit()
@@ -58,7 +89,12 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
-        if user and bcrypt.check_password_hash(user.password, form.password.data):
+        if user and check_password(user.password, form.password.data):
+            if needs_rehash(user.password):
+                # the work factor changed since this hash was made, the plain password is only known right now
+                user.password = hash_password(form.password.data)
+                db.session.commit()
+                forget_user(user.id)
             login_user(user, remember=form.remember.data)
             # next is url trying to access without loging in
             # we will return this same url if user logs in as it would be conveinient for user
@@ -83,43 +119,16 @@ def react_to_post(post_id):
     if reaction_type not in ['like', 'dislike']:
         return jsonify({"error": "Invalid reaction type"}), 400
 
-    post = Post.query.get_or_404(post_id)
-
-    # Check if the user has already reacted to this post
-    existing_reaction = PostReaction.query.filter_by(post_id=post_id, user_id=current_user.id).first()
+    # make sure the post exists, the counters themselves are updated atomically in SQL
+    author_id = db.first_or_404(db.select(Post.user_id).filter_by(id=post_id))
+    likes, dislikes = react(post_id, author_id, current_user.id, reaction_type)
+    invalidate(f"post:{post_id}", 'trending')
 
-    if existing_reaction:
-        # If the user has already reacted, update their reaction
-        if existing_reaction.reaction_type == reaction_type:
-            # If they are trying to react the same way again, remove the reaction
-            db.session.delete(existing_reaction)
-            if reaction_type == 'like':
-                post.likes_count -= 1
-            else:
-                post.dislikes_count -= 1
-        else:
-            # If they had a different reaction, change it
-            existing_reaction.reaction_type = reaction_type
-            if reaction_type == 'like':
-                post.likes_count += 1
-                post.dislikes_count -= 1
-            else:
-                post.dislikes_count += 1
-                post.likes_count -= 1
-    else:
-        # If the user has not reacted before, create a new reaction
-        new_reaction = PostReaction(post_id=post_id, user_id=current_user.id, reaction_type=reaction_type)
-        db.session.add(new_reaction)
-        if reaction_type == 'like':
-            post.likes_count += 1
-        else:
-            post.dislikes_count += 1
-
-    db.session.commit()
-    return jsonify({"message": "Reaction updated successfully", "likes": post.likes_count, "dislikes": post.dislikes_count}), 200
+    return jsonify({"message": "Reaction updated successfully", "likes": likes, "dislikes": dislikes}), 200
 
 
 @app.route("/post/<int:post_id>/reactions", methods=['GET'])
+@read_only
 @login_required
 def get_reactions(post_id):
     post = Post.query.get_or_404(post_id)
@@ -143,26 +152,48 @@ def get_reactions(post_id):
     }), 200
 
 
+MAX_BULK_REACTION_IDS = 100
 
-def save_picture(form_picture) -> str:
-    ''' Converting the image to a hex name to ensure it doesn't collide with any other image name '''
-    if form_picture is None:
-        raise ValueError("form_picture cannot be None")
-    
-    hex_name = secrets.token_hex(8)
-    _, ext = os.path.splitext(form_picture.filename)
-    pic_name = hex_name + ext
-    pic_path = os.path.join(app.root_path, 'static/profile_pics', pic_name)
-    
+@app.route("/posts/reactions", methods=['GET'])
+@read_only
+@login_required
+@query_budget(2)
+def get_bulk_reactions():
+    ''' Reaction counts and the current user's reaction for many posts at once, e.g. ?ids=1,2,3 '''
     try:
-        output_size = (125, 125)
-        resized = Image.open(form_picture)
-        resized = resized.resize(output_size, resample=Image.Resampling.LANCZOS)
-        resized.save(pic_path)
-    except Exception as e:
-        raise Exception("Error occurred while saving image: {}".format(str(e)))
-    
-    return pic_name
+        post_ids = {int(i) for i in request.args.get('ids', '').split(',') if i.strip()}
+    except ValueError:
+        return jsonify({"error": "ids must be a comma separated list of post ids"}), 400
+    if len(post_ids) > MAX_BULK_REACTION_IDS:
+        return jsonify({"error": f"At most {MAX_BULK_REACTION_IDS} ids per request"}), 400
+
+    # a single query: the counters live on post, the user's own reaction comes from an outer join
+    rows = db.session.query(Post.id, Post.likes_count, Post.dislikes_count, PostReaction.reaction_type)\
+        .outerjoin(PostReaction, (PostReaction.post_id == Post.id) & (PostReaction.user_id == current_user.id))\
+        .filter(Post.id.in_(post_ids))\
+        .all()
+
+    return jsonify({
+        "reactions": {
+            str(post_id): {"likes": likes, "dislikes": dislikes, "user_reaction": user_reaction}
+            for post_id, likes, dislikes, user_reaction in rows
+        }
+    }), 200
+
+
+def attach_user_reactions(posts):
+    ''' Sets `post.user_reaction` for every post in the list with one query, templates render it directly '''
+    reactions = {}
+    if current_user.is_authenticated and posts:
+        reactions = dict(
+            db.session.query(PostReaction.post_id, PostReaction.reaction_type)
+            .filter(PostReaction.user_id == current_user.id, PostReaction.post_id.in_([p.id for p in posts]))
+            .all()
+        )
+    for post in posts:
+        post.user_reaction = reactions.get(post.id)
+    return posts
+
 
 
 @app.route("/account", methods=['GET', 'POST'])
@@ -176,13 +207,14 @@ def account():
         current_user.username = form.username.data
         current_user.email = form.email.data  
         db.session.commit()
+        forget_user(current_user.id)
+        invalidate(f"user:{current_user.id}")
         flash("Your account has been updated successfully!", category='success')
         return redirect(url_for('account'))
     elif request.method == "GET":
         form.username.data = current_user.username
         form.email.data = current_user.email  # Corrected line
-    image_file = url_for('static', filename='profile_pics/' + current_user.profile_pic)
-    return render_template("account.html", title='Account', image_file=image_file, form=form)
+    return render_template("account.html", title='Account', form=form)
 
 @app.route("/post/new", methods=['GET', 'POST'])
 @login_required
@@ -192,13 +224,19 @@ def new_post():
         post = Post(title=form.title.data, content=form.content.data, author=current_user)
         db.session.add(post)
         db.session.commit()
+        invalidate('feed')
         flash("Your post has been created succesfully!", category='success')
         return redirect(url_for('home'))
     return render_template("create_post.html", title="New Post", form=form, legend="New Post")
 
 @app.route("/post/<int:post_id>")
+@read_only
+@cached_page()
+@query_budget(3)
 def post(post_id):
-    post = Post.query.get_or_404(post_id)
+    post = Post.feed_query(with_content=True).get_or_404(post_id)
+    attach_user_reactions([post])
+    cache_tags(f"post:{post.id}", f"user:{post.user_id}")
     return render_template('post.html', title=post.title, post=post)
 
 @app.route("/post/<int:post_id>/update", methods=['GET', 'POST'])
@@ -211,7 +249,9 @@ def update_post(post_id):
     if form.validate_on_submit():
         post.title = form.title.data
         post.content = form.content.data
+        post.date_updated = datetime.utcnow()
         db.session.commit()
+        invalidate(f"post:{post_id}")
         flash("Post has been updated successfully!", category="success")
         return redirect(url_for("post", post_id=post_id))
     elif request.method == "GET":
@@ -225,19 +265,23 @@ def delete_post(post_id):
     post = Post.query.get_or_404(post_id)
     if current_user.username != 'admin' and current_user != post.author:
         abort(403)
+    forget_post(post.id, post.user_id)
     db.session.delete(post)
     db.session.commit()
+    invalidate(f"post:{post_id}")
     flash("Your post has been deleted successfully!", category="success")
     return redirect(url_for("home"))
 
 @app.route("/user/<string:username>")
+@read_only
 @login_required
+@query_budget(4)
 def user_posts(username: str):
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     user = User.query.filter_by(username=username).first_or_404()
-    posts = Post.query.filter_by(author=user)\
-        .order_by(Post.date_posted.desc())\
-        .paginate(per_page=2, page=page)
+    # the header shows the author's post count, so ask for it (scoped to one author, not the whole table)
+    posts = keyset_paginate(Post.feed_query().filter_by(author=user), (Post.date_posted, Post.id),
+                            cursor=cursor, per_page=2, with_total=True)
     return render_template("user_posts.html", posts=posts, user=user, title="User")
 
 def send_reset_email(user: User):
@@ -256,7 +300,7 @@ def send_reset_email(user: User):
     <b><i>If you did not make this request, then simply ignore this email.</i></b>
     '''
 
-    mail.send(msg)
+    queue_mail(msg)
     
 
 @app.route("/reset_password", methods=["GET", "POST"])
@@ -284,17 +328,20 @@ def reset_token(token):
         return redirect(url_for('reset_request'))
     form = ResetPasswordForm()
     if form.validate_on_submit():
-        hashed_pw = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+        hashed_pw = hash_password(form.password.data)
         user.password = hashed_pw
         db.session.commit()
+        forget_user(user.id)
         flash(f"The password is updated.", category='success')
     return render_template('reset_token.html', title='Reset Password', form=form)
 
 
 # REPORT GENERATION MODULE  
-import io
-from flask import request, jsonify, abort
-from blogify.report import generate_csv_report, generate_excel_report, generate_pdf_report
+# reports are rendered in background worker processes, see blogify/jobs.py
+from blogify.jobs import REPORT_FORMATS, submit_report_job, report_path, report_data_version, cached_report_job, touch_report_job
+from blogify.models import ReportJob
+from blogify.export import EXPORT_FORMATS, stream_csv, stream_jsonl
+from blogify.report_data import build_report_data
 
 @app.route("/generate_report/<string:username>", methods=['GET', 'POST'])
 @login_required
@@ -305,50 +352,76 @@ def generate_report(username):
         abort(403)  # Return a 403 Forbidden error if not admin
 
     report_type = request.args.get('type', 'pdf')
+    if report_type not in REPORT_FORMATS:
+        return jsonify({"error": "Invalid report type"}), 400
 
-    posts = Post.query.filter_by(author=user).order_by(Post.date_posted.desc()).all()
+    # nothing changed since the last report of this kind, hand out the same file again
+    data_version = report_data_version(user)
+    job = cached_report_job(user.username, report_type, data_version)
+    if job:
+        return jsonify(report_job_status(job)), 200 if job.status == 'done' else 202
 
-    total_likes = sum(post.likes_count for post in posts)
-    total_dislikes = sum(post.dislikes_count for post in posts)
-    avg_likes = total_likes / len(posts) if posts else 0
-    avg_dislikes = total_dislikes / len(posts) if posts else 0
+    report_data, engagement_data = build_report_data(user, report_type)
 
-    most_liked_post = max(posts, key=lambda p: p.likes_count, default=None)
-    most_disliked_post = max(posts, key=lambda p: p.dislikes_count, default=None)
+    # Queue the report, the client polls the status url and downloads the file once it is done
+    job = submit_report_job(user.username, report_type, data_version, report_data, engagement_data)
+    return jsonify(report_job_status(job)), 202
 
-    engagement_data = {
-        "dates": [post.date_posted for post in posts],
-        "likes": [post.likes_count for post in posts],
-        "dislikes": [post.dislikes_count for post in posts]
-    }
 
-    # Prepare report data
-    report_data = {
-        "username": user.username,
-        "email": user.email,
-        "total_posts": len(posts),
-        "total_likes": total_likes,
-        "total_dislikes": total_dislikes,
-        "average_likes": avg_likes,
-        "average_dislikes": avg_dislikes,
-        "most_liked_post": most_liked_post,
-        "most_disliked_post": most_disliked_post,
-        "posts": [
-            {
-                "title": post.title,
-                "date_posted": post.date_posted,
-                "content": post.content,
-                "likes": post.likes_count,
-                "dislikes": post.dislikes_count
-            }
-            for post in posts
-        ]
+def report_job_status(job: ReportJob) -> dict:
+    status = {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": url_for('report_status', job_id=job.id),
     }
+    if job.status == 'done':
+        status["download_url"] = url_for('download_report', job_id=job.id)
+    elif job.status == 'failed':
+        status["error"] = "Report generation failed"
+    return status
 
-    # Generate the report based on the specified type
-    if report_type == 'csv':
-        return generate_csv_report(report_data)
-    elif report_type == 'excel':
-        return generate_excel_report(report_data)
-    else:
-        return generate_pdf_report(report_data, engagement_data)
\ No newline at end of file
+
+@app.route("/reports/<string:job_id>", methods=['GET'])
+@login_required
+def report_status(job_id):
+    if current_user.username != 'admin':
+        abort(403)
+    job = db.get_or_404(ReportJob, job_id)
+    return jsonify(report_job_status(job)), 200
+
+
+@app.route("/reports/<string:job_id>/download", methods=['GET'])
+@login_required
+def download_report(job_id):
+    if current_user.username != 'admin':
+        abort(403)
+    job = db.get_or_404(ReportJob, job_id)
+    if job.status != 'done':
+        return jsonify(report_job_status(job)), 409
+
+    touch_report_job(job)
+    extension, mimetype = REPORT_FORMATS[job.report_type]
+    # the data version makes a strong ETag, browsers revalidate with If-None-Match and get a 304
+    response = send_file(report_path(job), as_attachment=True, download_name=f"{job.username}_report.{extension}",
+                         mimetype=mimetype, etag=f"{job.data_version}-{job.report_type}", conditional=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@app.route("/export/<string:username>", methods=['GET'])
+@read_only
+@login_required
+def export_posts(username):
+    ''' Streams all of a user's posts as CSV or JSON Lines without building the file in memory '''
+    if current_user.username != 'admin':
+        abort(403)
+    user = User.query.filter_by(username=username).first_or_404()
+
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": "Invalid export format"}), 400
+
+    rows = stream_csv(user.id) if export_format == 'csv' else stream_jsonl(user.id)
+    extension, mimetype = EXPORT_FORMATS[export_format]
+    return Response(stream_with_context(rows), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={user.username}_posts.{extension}"})
@@ -0,0 +1,100 @@
+import re
+import click
+from sqlalchemy import event, table, column, text
+from blogify import app, db
+from blogify.models import Post
+from blogify.pagination import keyset_paginate
+
+
+# -- Full text search --
+# post_fts is an SQLite FTS5 index over post.title/post.content. It is an "external content"
+# table, so the text itself is only stored once (in post), the index just holds the tokens.
+# Triggers keep it in sync with every insert/delete and with updates that touch title or content.
+
+_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5(
+        title, content, content='post', content_rowid='id', tokenize='porter unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS post_fts_ai AFTER INSERT ON post BEGIN
+        INSERT INTO post_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS post_fts_ad AFTER DELETE ON post BEGIN
+        INSERT INTO post_fts(post_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS post_fts_au AFTER UPDATE OF title, content ON post BEGIN
+        INSERT INTO post_fts(post_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO post_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+    # matches in the title weigh more than matches in the body, `ORDER BY rank` then uses this
+    "INSERT INTO post_fts(post_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')",
+]
+
+post_fts = table('post_fts', column('rowid'), column('rank'))
+
+
+def _fts_enabled(connection) -> bool:
+    return connection.dialect.name == 'sqlite'
+
+
+@event.listens_for(db.metadata, 'after_create')
+def create_search_index(target, connection, **kw):
+    ''' Runs on db.create_all(), builds the index (and backfills it) the first time only '''
+    if not _fts_enabled(connection):
+        return
+    exists = connection.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE type='table' AND name='post_fts'").first()
+    if exists:
+        return
+    for stmt in _FTS_DDL:
+        connection.exec_driver_sql(stmt)
+    connection.exec_driver_sql("INSERT INTO post_fts(post_fts) VALUES ('rebuild')")
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def drop_search_index(target, connection, **kw):
+    if _fts_enabled(connection):
+        connection.exec_driver_sql("DROP TABLE IF EXISTS post_fts")
+
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index():
+    ''' Create the search index if needed and re-tokenize every post into it '''
+    with db.engine.begin() as connection:
+        for stmt in _FTS_DDL:
+            connection.exec_driver_sql(stmt)
+        connection.exec_driver_sql("INSERT INTO post_fts(post_fts) VALUES ('rebuild')")
+        connection.exec_driver_sql("INSERT INTO post_fts(post_fts) VALUES ('optimize')")
+    click.echo("Search index rebuilt.")
+
+
+def build_match_query(query: str) -> str:
+    '''
+    Turn free text from the search box into a safe FTS5 expression.
+    Every word must match, the last one as a prefix so results show up while the user is still typing.
+    '''
+    words = re.findall(r'\w+', query)
+    if not words:
+        return ''
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_posts(query: str, cursor: str = None, per_page: int = 5):
+    ''' Ranked search results as a KeysetPage of posts, best match first '''
+    match = build_match_query(query)
+    if not _fts_enabled(db.session.get_bind()):
+        # no FTS available on this backend, fall back to plain substring matching
+        return keyset_paginate(Post.feed_query().filter(Post.title.contains(query) | Post.content.contains(query)),
+                               (Post.date_posted, Post.id), cursor=cursor, per_page=per_page)
+    if not match:
+        return keyset_paginate(Post.feed_query(), (Post.date_posted, Post.id), cursor=cursor, per_page=per_page)
+
+    rows = db.session.query(Post, post_fts.c.rank)\
+        .join(post_fts, post_fts.c.rowid == Post.id)\
+        .options(db.joinedload(Post.author), db.defer(Post.content))\
+        .filter(text("post_fts MATCH :match").bindparams(match=match))
+    # bm25 scores are negative, the lower the better, so the feed walks the keys in ascending order
+    page = keyset_paginate(rows, (post_fts.c.rank, Post.id), cursor=cursor, per_page=per_page,
+                           descending=False, key_of=lambda row: [row.rank, row.Post.id])
+    page.items = [row.Post for row in page.items]
+    return page
@@ -0,0 +1,167 @@
+import time
+import click
+from datetime import datetime
+from sqlalchemy import select, update, case
+from sqlalchemy.dialects.sqlite import insert
+from blogify import app, db
+from blogify.models import Post, PostReaction, TrendingState
+from blogify.pagination import keyset_paginate
+from blogify.forksafe import ForkSafeLazy, reset_after_fork, start_daemon
+
+
+# -- Trending score --
+# A reaction made at time t is worth weight * 2^-((now - t) / half life). Every score decays by the
+# same factor, so instead of decaying each one the stored post.trending_score holds the sum of
+# weight * 2^((t - epoch) / half life) for a shared epoch: the ordering is the same at any moment,
+# react() only adds (or takes back) one term and the trending feed is a walk down
+# ix_post_trending_score_id. A periodic tick moves the epoch to now and rescales the positive
+# scores in one statement (so they never overflow), dropping those that decayed below
+# TRENDING_MIN_SCORE out of the feed. React updates are guarded by the epoch they were computed
+# for, so a tick in another process in between simply makes them recompute and retry.
+
+UNIX_EPOCH = datetime(1970, 1, 1)
+
+_epoch = None       # this process' copy of trending_state.epoch
+
+
+@reset_after_fork
+def _forget_epoch():
+    global _epoch
+    _epoch = None
+
+
+def _unix(when: datetime) -> float:
+    return (when - UNIX_EPOCH).total_seconds()
+
+
+def _half_life() -> float:
+    return app.config['TRENDING_HALF_LIFE_HOURS'] * 3600
+
+
+def _term(reacted: datetime, likes: int, dislikes: int, epoch: float) -> float:
+    engagement = likes * app.config['TRENDING_LIKE_WEIGHT'] + dislikes * app.config['TRENDING_DISLIKE_WEIGHT']
+    return engagement * 2 ** ((_unix(reacted) - epoch) / _half_life())
+
+
+def current_epoch(refresh: bool = False) -> float:
+    ''' The epoch the stored scores are relative to, set up on first use, in the caller's transaction '''
+    global _epoch
+    if _epoch is None or refresh:
+        epoch = db.session.execute(select(TrendingState.epoch).filter_by(id=1)).scalar()
+        if epoch is None:
+            db.session.execute(insert(TrendingState).values(id=1, epoch=_unix(datetime.utcnow())).on_conflict_do_nothing())
+            epoch = db.session.execute(select(TrendingState.epoch).filter_by(id=1)).scalar()
+        _epoch = epoch
+    return _epoch
+
+
+def record_trending_changes(post_id: int, changes):
+    ''' Add the (time reacted, likes delta, dislikes delta) changes to the post's score, in the caller's transaction '''
+    decay_ticker.get()
+    for attempt in range(2):
+        epoch = current_epoch(refresh=attempt > 0)
+        delta = sum(_term(reacted, likes, dislikes, epoch) for reacted, likes, dislikes in changes)
+        if delta == 0:
+            return
+        stored_epoch = select(TrendingState.epoch).filter_by(id=1).scalar_subquery()
+        # taking back a reaction whose term a tick already pruned to 0 must not push the score below it
+        score = Post.trending_score + delta
+        result = db.session.execute(
+            update(Post).where(Post.id == post_id, stored_epoch == epoch)
+            .values(trending_score=case((score < 0, 0.0), else_=score)),
+            execution_options={'synchronize_session': False},
+        )
+        if result.rowcount:
+            return
+
+
+def decay_tick(force: bool = False) -> bool:
+    ''' Rebase the scores onto the current time, False when another process did so less than half an interval ago '''
+    global _epoch
+    now = _unix(datetime.utcnow())
+    old = current_epoch(refresh=True)
+    if not force and now - old < app.config['TRENDING_TICK_INTERVAL'] / 2:
+        db.session.commit()
+        return False
+    # taking the epoch row first serializes concurrent ticks, only one of them gets to rescale
+    if db.session.execute(update(TrendingState).filter_by(id=1, epoch=old).values(epoch=now)).rowcount == 0:
+        db.session.rollback()
+        return False
+    factor = 2 ** ((old - now) / _half_life())
+    rescaled = Post.trending_score * factor
+    db.session.execute(
+        update(Post).where(Post.trending_score > 0)
+        .values(trending_score=case((rescaled < app.config['TRENDING_MIN_SCORE'], 0.0), else_=rescaled)),
+        execution_options={'synchronize_session': False},
+    )
+    db.session.commit()
+    _epoch = now
+    return True
+
+
+def rebuild_scores(connection) -> int:
+    ''' Recompute every score from post_reaction with a fresh epoch, returns the number of trending posts '''
+    global _epoch
+    epoch = _unix(datetime.utcnow())
+    scores = {}
+    rows = connection.execute(select(PostReaction.post_id, PostReaction.reaction_type, PostReaction.date_reacted))
+    for post_id, reaction_type, reacted in rows:
+        term = _term(reacted, reaction_type == 'like', reaction_type == 'dislike', epoch)
+        scores[post_id] = scores.get(post_id, 0.0) + term
+    scores = {post_id: score for post_id, score in scores.items() if score >= app.config['TRENDING_MIN_SCORE']}
+
+    post = Post.__table__
+    connection.execute(update(post).values(trending_score=0.0))
+    if scores:
+        connection.execute(update(post).where(post.c.id == db.bindparam('post_id')).values(trending_score=db.bindparam('score')),
+                           [{'post_id': post_id, 'score': score} for post_id, score in scores.items()])
+    statement = insert(TrendingState).values(id=1, epoch=epoch)
+    connection.execute(statement.on_conflict_do_update(index_elements=['id'], set_={'epoch': statement.excluded.epoch}))
+    _epoch = None
+    return len(scores)
+
+
+def trending_posts(cursor: str = None, per_page: int = 5):
+    '''
+    Posts by decayed engagement, highest first, as a KeysetPage.
+    A cursor holds the last score it saw, relative to the epoch of that moment. A tick in between
+    shrinks every score, so the next page for an older cursor starts higher up and repeats posts.
+    '''
+    decay_ticker.get()
+    return keyset_paginate(Post.feed_query().filter(Post.trending_score > 0), (Post.trending_score, Post.id),
+                           cursor=cursor, per_page=per_page)
+
+
+class DecayTicker:
+    ''' Daemon thread running decay_tick() every TRENDING_TICK_INTERVAL seconds '''
+
+    def __init__(self):
+        self._thread = start_daemon(self._run, 'trending-decay')
+
+    def _run(self):
+        while True:
+            time.sleep(app.config['TRENDING_TICK_INTERVAL'])
+            try:
+                with app.app_context():
+                    decay_tick()
+            except Exception:
+                app.logger.exception("Decaying trending scores failed")
+
+
+# one ticker per (forked) worker process, started on first use
+decay_ticker = ForkSafeLazy(DecayTicker)
+
+
+@app.cli.command('decay-trending')
+def decay_trending():
+    ''' Rebase and prune the trending scores now instead of waiting for the next tick '''
+    decay_tick(force=True)
+    click.echo("Trending scores decayed.")
+
+
+@app.cli.command('rebuild-trending')
+def rebuild_trending():
+    ''' Recompute every trending score from the raw reactions '''
+    with db.engine.begin() as connection:
+        count = rebuild_scores(connection)
+    click.echo(f"Trending scores rebuilt, {count} post(s) trending.")
@@ -0,0 +1,45 @@
+'''
+Production server: gunicorn with WEB_WORKERS processes of WEB_THREADS threads each, all forked
+from a master that loaded the app once (see blogify.create_app and the WEB_* settings).
+
+    WEB_WORKERS=4 WEB_THREADS=8 python3 serve.py
+
+Signals to the master: HUP starts fresh workers and lets the old ones finish their requests
+(graceful reload), TTIN/TTOU add/remove a worker, TERM stops gracefully. The app code is
+preloaded, so deploying new code means starting a new master: USR2 then QUIT to the old one.
+'''
+from gunicorn.app.base import BaseApplication
+from blogify import app, create_app
+
+
+class BlogifyServer(BaseApplication):
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return create_app()
+
+
+def server_options() -> dict:
+    threads = app.config['WEB_THREADS']
+    return {
+        'bind': app.config['WEB_BIND'],
+        'workers': app.config['WEB_WORKERS'],
+        'threads': threads,
+        'worker_class': 'gthread' if threads > 1 else 'sync',
+        'preload_app': True,
+        'timeout': app.config['WEB_TIMEOUT'],
+        'graceful_timeout': app.config['WEB_GRACEFUL_TIMEOUT'],
+        'max_requests': app.config['WEB_MAX_REQUESTS'],
+        'max_requests_jitter': app.config['WEB_MAX_REQUESTS'] // 10,
+        'accesslog': '-',
+    }
+
+
+if __name__ == "__main__":
+    BlogifyServer(server_options()).run()